@@ -0,0 +1,28 @@
+import os
+import argparse
+
+from aiohttp import web
+
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+from serving import resources as serving_resources
+from serving.api import ChatServer
+from instrumentation.telemetry import setup
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Headless streaming API of the IndustryInsider Assistant")
+    parser.add_argument("--host",default=os.environ.get("API_HOST","0.0.0.0"))
+    parser.add_argument("--port",type=int,default=int(os.environ.get("API_PORT","8000")))
+    parser.add_argument("--stand-ins",action="store_true",help="serve with the local embedding and llm stand-ins (no API keys needed)")
+    args=parser.parse_args()
+    if args.stand_ins:
+        from benchmarks.stand_ins import LocalEmbeddings, LocalChatModel
+        serving_resources.HuggingFaceInferenceAPIEmbeddings=LocalEmbeddings
+        serving_resources.ChatGoogleGenerativeAI=LocalChatModel
+    #Creating a log file
+    logger=setup("Api","Api_server")
+    #one event loop serves every request, blocking pipeline calls run on the server's bounded worker pool
+    server=ChatServer.from_env(serving_resources.get_resources())
+    web.run_app(server.app,host=args.host,port=args.port)
@@ -0,0 +1,88 @@
+'''Micro-benchmark of the chunking stage: SemanticChunker with recursive token splits vs the single-pass chunker'''
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tiktoken
+from langchain_experimental.text_splitter import SemanticChunker
+
+from benchmarks.stand_ins import LocalEmbeddings
+from ingestion.chunker import SinglePassSemanticChunker
+
+SENTENCE_PATTERN=re.compile(r"(?<=[.?!])\s+")
+
+
+def baseline_chunks(text, splitter, encoding, max_tokens, max_depth=50):
+    '''Function: To chunk a text the way Data_loading did before the single-pass chunker'''
+    def split_chunks(chunk, depth):
+        #the recursion never ends on a segment SemanticChunker cannot split, it is cut off here
+        if len(encoding.encode(chunk.page_content))<=max_tokens or depth==max_depth:
+            yield chunk
+            return
+        for subsplit in splitter.create_documents([chunk.page_content]):
+            yield from split_chunks(subsplit,depth+1)
+    return [chunk.page_content for document in splitter.create_documents([text]) for chunk in split_chunks(document,0)]
+
+
+def boundaries(chunks):
+    '''Function: To return the sentence positions where the chunks start'''
+    starts,position=set(),0
+    for chunk in chunks:
+        starts.add(position)
+        position+=len(SENTENCE_PATTERN.split(chunk))
+    return starts
+
+
+def load_texts(articles_dir, join):
+    '''Function: To load the stored articles, join of them concatenated into one long text'''
+    articles=[]
+    for article_file in sorted(glob.glob(os.path.join(articles_dir,"*.md"))):
+        with open(article_file,'r',encoding='utf-8') as file:
+            articles.append(file.read())
+    return [" ".join(articles[index:index+join]) for index in range(0,len(articles),join)]
+
+
+def timed(label, texts, chunk, embeddings, encoding, max_tokens):
+    '''Function: To chunk all texts and report the embedding calls, the CPU time and the chunk sizes'''
+    embeddings.calls,embeddings.texts=0,0
+    wall,cpu=time.perf_counter(),time.process_time()
+    results=[chunk(text) for text in texts]
+    wall,cpu=time.perf_counter()-wall,time.process_time()-cpu
+    sizes=[len(encoding.encode(item)) for chunks in results for item in chunks]
+    print(f"{label:<24}{embeddings.calls:>8} calls{embeddings.texts:>9} texts{wall:>9.3f}s{cpu:>9.3f}s cpu"
+          f"{len(sizes):>7} chunks{max(sizes):>7} max tokens")
+    return results
+
+
+def main():
+    '''Main function'''
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles",default="./data/Articles")
+    parser.add_argument("--join",type=int,default=3,help="articles concatenated into one text, longer texts recurse deeper")
+    parser.add_argument("--max-tokens",type=int,default=int(os.environ.get("MAX_CHUNK_TOKENS","128")))
+    parser.add_argument("--embedding-call-latency",type=float,default=0.05,help="simulated seconds per embedding API call")
+    parser.add_argument("--embedding-text-latency",type=float,default=0.0005,help="simulated seconds per embedded text")
+    args=parser.parse_args()
+
+    texts=load_texts(args.articles,args.join)
+    if not texts:
+        sys.exit("No articles found")
+    encoding=tiktoken.get_encoding(os.environ.get("TIKTOKEN_MODEL","cl100k_base"))
+    embeddings=LocalEmbeddings(call_latency=args.embedding_call_latency,text_latency=args.embedding_text_latency)
+    splitter=SemanticChunker(embeddings,breakpoint_threshold_type="percentile")
+    baseline=timed("SemanticChunker (baseline)",texts,lambda text: baseline_chunks(text,splitter,encoding,args.max_tokens),
+                   embeddings,encoding,args.max_tokens)
+    chunker=SinglePassSemanticChunker(embeddings,encoding,args.max_tokens)
+    single=timed("single pass",texts,chunker.split_text,embeddings,encoding,args.max_tokens)
+    #breakpoints of oversized segments reuse the top level distances, so deeper splits may move slightly
+    agreement=[len(boundaries(old)&boundaries(new))/len(boundaries(old)|boundaries(new)) for old,new in zip(baseline,single)]
+    print(f"Chunk boundaries shared with the baseline: {sum(agreement)/len(agreement):.1%}")
+
+
+if __name__=="__main__":
+    main()
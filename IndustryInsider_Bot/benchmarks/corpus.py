@@ -0,0 +1,69 @@
+'''Synthetic corpora grown from the stored articles, deterministic for a given seed'''
+import os
+import re
+import glob
+import random
+
+from langchain_core.documents import Document
+
+from ingestion.manifest import IngestionManifest
+
+SENTENCE_PATTERN=re.compile(r"(?<=[.?!])\s+")
+
+
+def load_articles(articles_dir):
+    '''Function: To load the stored articles as (title, paragraphs, sentences)'''
+    articles=[]
+    for article_file in sorted(glob.glob(os.path.join(articles_dir,"*.md"))):
+        with open(article_file,'r',encoding='utf-8') as file:
+            title,_,body=file.read().partition("\n\n")
+        paragraphs=[paragraph.strip() for paragraph in body.split("\n") if paragraph.strip()]
+        sentences=[sentence for paragraph in paragraphs for sentence in SENTENCE_PATTERN.split(paragraph) if sentence]
+        if sentences:
+            articles.append((title.strip(),paragraphs,sentences))
+    if not articles:
+        raise FileNotFoundError(f"No articles found in {articles_dir}")
+    return articles
+
+
+def grow_articles(articles, count, output_dir, seed=0):
+    '''Function: To write count synthetic articles, each mixing the paragraphs of a few stored articles'''
+    rng=random.Random(seed)
+    os.makedirs(output_dir,exist_ok=True)
+    for number in range(count):
+        sources=rng.sample(articles,min(3,len(articles)))
+        paragraphs=[paragraph for _,source_paragraphs,_ in sources for paragraph in source_paragraphs]
+        rng.shuffle(paragraphs)
+        title=f"{sources[0][0]} {number}"
+        with open(os.path.join(output_dir,f"synthetic_{number:07d}.md"),'w',encoding='utf-8') as file:
+            file.write("\n\n".join([title,"\n".join(paragraphs)]))
+
+
+def synthetic_chunks(articles, count, batch_size=1000, seed=0, min_sentences=3, max_sentences=8):
+    '''Function: To yield batches of (ids, documents) of count chunks made of consecutive sentences'''
+    rng=random.Random(seed)
+    ids,documents=[],[]
+    for number in range(count):
+        title,_,sentences=articles[rng.randrange(len(articles))]
+        length=rng.randint(min_sentences,max_sentences)
+        start=rng.randrange(max(len(sentences)-length,0)+1)
+        source=f"synthetic_{number//20:07d}.md"
+        documents.append(Document(page_content=" ".join(sentences[start:start+length]),
+                                  metadata={"source": source,"chunk_index": number%20,"title": title}))
+        ids.append(IngestionManifest.chunk_id(source,number%20))
+        if len(ids)==batch_size:
+            yield ids,documents
+            ids,documents=[],[]
+    if ids:
+        yield ids,documents
+
+
+def sample_questions(articles, count, seed=0):
+    '''Function: To pick count question-like queries from the article sentences'''
+    rng=random.Random(seed)
+    questions=[]
+    for _ in range(count):
+        _,_,sentences=articles[rng.randrange(len(articles))]
+        words=rng.choice(sentences).split()
+        questions.append(f"What does the news say about {' '.join(words[:12])}?")
+    return questions
@@ -0,0 +1,166 @@
+'''Stand-in server harness for the AsyncCrawler: retries, 304 revalidation, resuming, the per-host connection limit and streaming hand-over'''
+import gc
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from langchain_core.documents import Document
+
+from crawler.async_crawler import AsyncCrawler
+from crawler.frontier import CrawlFrontier
+
+LISTING_PATH="/industry/indl-goods/svs/engineering"
+
+
+class StandInSite():
+    '''Class to serve an Economic Times like listing page and its articles, failing and revalidating like the real site'''
+    def __init__(self, articles, latency, failing_every):
+        '''Constructor for initialization'''
+        self.articles=articles
+        self.latency=latency
+        #every failing_every-th article answers 503 on its first request
+        self.failing_every=failing_every
+        self.requests={}
+        self.active=0
+        self.peak_active=0
+        self.not_modified=0
+
+    def expected_retries(self):
+        '''Function: To count the articles answering 503 once'''
+        return len([number for number in range(self.articles) if self.failing_every and number%self.failing_every==0])
+
+    async def listing(self, request):
+        '''Function: To serve the listing page with the article links, answering 304 while no article is added'''
+        etag=f'"listing-{self.articles}"'
+        if request.headers.get("If-None-Match")==etag:
+            self.not_modified+=1
+            return web.Response(status=304)
+        links="".join(f"<li><a href='{LISTING_PATH}/story-{number}/articleshow/{number}.cms'>Story {number}</a></li>"
+                      for number in range(self.articles))
+        return web.Response(text=f"<html><body><ul>{links}</ul><a href='/about'>About</a></body></html>",content_type="text/html",
+                            headers={"ETag": etag})
+
+    async def article(self, request):
+        '''Function: To serve an article after the simulated latency, counting the concurrent requests'''
+        number=int(request.match_info["number"])
+        self.requests[number]=self.requests.get(number,0)+1
+        self.active+=1
+        self.peak_active=max(self.peak_active,self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active-=1
+        if self.failing_every and number%self.failing_every==0 and self.requests[number]==1:
+            return web.Response(status=503,headers={"Retry-After": "0"})
+        etag=f'"story-{number}"'
+        if request.headers.get("If-None-Match")==etag:
+            self.not_modified+=1
+            return web.Response(status=304)
+        body=f"<html><head><title>Story {number} - The Economic Times</title></head><body><div class='artText'>Story {number} body.</div></body></html>"
+        return web.Response(text=body,content_type="text/html",headers={"ETag": etag})
+
+    def start(self):
+        '''Function: To serve the site on a free local port from a background thread, returns the base url'''
+        app=web.Application()
+        app.router.add_get(LISTING_PATH,self.listing)
+        app.router.add_get(LISTING_PATH+"/{slug}/articleshow/{number}.cms",self.article)
+        started=threading.Event()
+        address={}
+
+        def serve():
+            loop=asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            runner=web.AppRunner(app)
+            loop.run_until_complete(runner.setup())
+            site=web.TCPSite(runner,"127.0.0.1",0)
+            loop.run_until_complete(site.start())
+            address["port"]=site._server.sockets[0].getsockname()[1]
+            started.set()
+            loop.run_forever()
+        threading.Thread(target=serve,daemon=True).start()
+        started.wait()
+        return f"http://127.0.0.1:{address['port']}/"
+
+
+def crawl(url_prefix, frontier_path, validators_path, args, crash_on=None):
+    '''Function: To run one crawl, returns the crawler, the handed over count, the peak pages alive and the timings'''
+    crawler=AsyncCrawler(url_prefix,max_connections=args.max_connections,per_host_connections=args.per_host,
+                         requests_per_second=args.requests_per_second,backoff=0.05,validators_path=validators_path,
+                         frontier=CrawlFrontier(frontier_path))
+    peak={"alive": 0,"first": None,"handed": 0,"sources": set()}
+    start=time.perf_counter()
+
+    def on_document(document):
+        if document.metadata["source"]==crash_on:
+            raise RuntimeError(f"Simulated crash while saving {crash_on}")
+        if peak["first"] is None:
+            peak["first"]=time.perf_counter()-start
+        peak["handed"]+=1
+        peak["sources"].add(document.metadata["source"])
+        #walking the heap is slow, pages alive are sampled every few articles
+        if peak["handed"]%args.sample_every==1:
+            peak["alive"]=max(peak["alive"],sum(1 for item in gc.get_objects() if type(item) is Document))
+        return True
+    count=crawler.run([url_prefix+LISTING_PATH.lstrip("/")],on_document=on_document)
+    return crawler,count,peak,time.perf_counter()-start
+
+
+def main():
+    '''Main function'''
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles",type=int,default=200)
+    parser.add_argument("--latency",type=float,default=0.02,help="seconds the stand-in server takes per article")
+    parser.add_argument("--failing-every",type=int,default=10,help="every n-th article answers 503 once")
+    parser.add_argument("--max-connections",type=int,default=20)
+    parser.add_argument("--per-host",type=int,default=4)
+    parser.add_argument("--requests-per-second",type=float,default=1000.0)
+    parser.add_argument("--sample-every",type=int,default=10,help="articles between two counts of the pages alive")
+    args=parser.parse_args()
+
+    site=StandInSite(args.articles,args.latency,args.failing_every)
+    url_prefix=site.start()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        validators_path=os.path.join(temp_dir,"http_validators.json")
+        crawler,count,peak,elapsed=crawl(url_prefix,os.path.join(temp_dir,"frontier.sqlite3"),validators_path,args)
+        print(f"First crawl: {count} articles in {elapsed:.3f}s ({count/elapsed:.1f} articles/s), stats: {crawler.stats}")
+        print(f"  first article handed over after {peak['first']:.3f}s, at most {peak['alive']} pages alive at once, "
+              f"at most {site.peak_active} concurrent requests seen by the server")
+        checks={"every article handed over": count==args.articles,
+                "503s retried": crawler.stats["retries"]==site.expected_retries() and crawler.stats["failed"]==0,
+                f"at most {args.per_host} concurrent requests to the host": site.peak_active<=args.per_host,
+                "pages held bounded by the in-flight limit": peak["alive"]<=crawler.max_in_flight}
+        #the stored validator of the unchanged listing page turns it into a 304, known articles are never requested
+        site.not_modified=0
+        article_requests=sum(site.requests.values())
+        crawler,count,_,elapsed=crawl(url_prefix,os.path.join(temp_dir,"frontier.sqlite3"),validators_path,args)
+        print(f"Revalidation crawl: {count} articles handed over in {elapsed:.3f}s, stats: {crawler.stats}")
+        checks["unchanged listing answered 304"]=(count==0 and crawler.stats["not_modified"]==site.not_modified==1
+                                                  and sum(site.requests.values())==article_requests)
+        #a crawl dying while an article is saved hands that article over again on the next run
+        resume_frontier=os.path.join(temp_dir,"frontier_resume.sqlite3")
+        resume_validators=os.path.join(temp_dir,"http_validators_resume.json")
+        crashed_url=url_prefix+LISTING_PATH.lstrip("/")+"/story-3/articleshow/3.cms"
+        try:
+            crawl(url_prefix,resume_frontier,resume_validators,args,crash_on=crashed_url)
+        except RuntimeError:
+            pass
+        _,resumed,resumed_peak,_=crawl(url_prefix,resume_frontier,resume_validators,args)
+        frontier=CrawlFrontier(resume_frontier)
+        print(f"Resumed crawl: {resumed} articles handed over, frontier: {frontier.stats()}")
+        checks["interrupted crawl resumed without losing articles"]=(crashed_url in resumed_peak["sources"]
+                                                                     and frontier.stats()=={"done": args.articles})
+    for check,passed in checks.items():
+        print(f"{check}: {passed}")
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,107 @@
+'''Micro-benchmark of the article extraction stage: pages/second of the html.parser baseline vs the ArticleExtractor'''
+import os
+import sys
+import glob
+import time
+import html
+import argparse
+import tempfile
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+
+from crawler.async_crawler import TITLE_PATTERN
+from crawler.extractor import ArticleExtractor
+
+EXTRACT_CLASS="artText"
+EXCLUDE_CLASSES=["growfast_widget custom_ad", "inSideInd"]
+PAGE_TEMPLATE="""<html><head><title>{title} - The Economic Times</title>
+<script>var config={{"ads":true}};</script></head><body>
+<div class="header"><ul>{navigation}</ul><div class="inSideInd">Trending in industry</div></div>
+<div class="growfast_widget custom_ad">Advertisement above the article</div>
+<div class="artText">{paragraphs}<script>window.dataLayer=window.dataLayer||[];</script><style>.artText p{{margin:0}}</style>
+<p>Published by the Economic Times.</p><div class="growfast_widget custom_ad">Sponsored content</div>
+<div class="inSideInd">Read more industry news</div></div>
+<div class="footer">{navigation}</div></body></html>"""
+
+
+def baseline_extract(raw_html, extract_class, exclude_classes):
+    '''Function: To extract one page the way WebScrap.extract_text did before the extraction stage'''
+    soup=BeautifulSoup(raw_html.page_content, "html.parser")
+    relevant_html=soup.find('div',class_=extract_class)
+    for class_name in exclude_classes:
+        ele=relevant_html.find('div',class_=class_name)
+        if ele:
+            ele.extract()
+    title=str(raw_html.metadata['title']).removesuffix(' - The Economic Times')
+    return title,"\n\n".join([title,relevant_html.text])
+
+
+def build_fixtures(articles_dir, fixtures_dir):
+    '''Function: To wrap the stored articles into Economic Times like html pages'''
+    navigation="".join(f"<li><a href='/industry/section{i}'>Section {i}</a></li>" for i in range(200))
+    for article_file in glob.glob(os.path.join(articles_dir,"*.md")):
+        with open(article_file,'r',encoding='utf-8') as file:
+            title,_,body=file.read().partition("\n\n")
+        paragraphs="".join(f"<p>{html.escape(paragraph)}</p>" for paragraph in body.split("\n") if paragraph)
+        page=PAGE_TEMPLATE.format(title=html.escape(title),navigation=navigation,paragraphs=paragraphs)
+        fixture_file=os.path.join(fixtures_dir,os.path.basename(article_file).removesuffix(".md")+".html")
+        with open(fixture_file,'w',encoding='utf-8') as file:
+            file.write(page)
+
+
+def load_fixtures(fixtures_dir, repeat):
+    '''Function: To load the saved html pages as documents in the AsyncHtmlLoader format'''
+    documents=[]
+    for fixture_file in sorted(glob.glob(os.path.join(fixtures_dir,"*.html"))):
+        with open(fixture_file,'r',encoding='utf-8') as file:
+            page_source=file.read()
+        match=TITLE_PATTERN.search(page_source)
+        title=html.unescape(match.group(1).strip()) if match else ""
+        documents.append(Document(page_content=page_source,metadata={"source": fixture_file,"title": title}))
+    return documents*repeat
+
+
+def timed(label, documents, extract):
+    '''Function: To run one extraction over all documents and report the pages/second'''
+    start=time.perf_counter()
+    results=list(extract(documents))
+    elapsed=time.perf_counter()-start
+    print(f"{label:<28}{len(documents):>8} pages{elapsed:>10.3f}s{len(documents)/elapsed:>12.1f} pages/s")
+    return results
+
+
+def main():
+    '''Main function'''
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures",help="directory of saved html pages (built from data/Articles when not given)")
+    parser.add_argument("--articles",default="./data/Articles")
+    parser.add_argument("--repeat",type=int,default=20,help="times every fixture is extracted")
+    parser.add_argument("--workers",type=int,default=os.cpu_count())
+    args=parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fixtures_dir=args.fixtures
+        if fixtures_dir is None:
+            fixtures_dir=temp_dir
+            build_fixtures(args.articles,fixtures_dir)
+        documents=load_fixtures(fixtures_dir,args.repeat)
+    if not documents:
+        sys.exit("No html fixtures found")
+
+    baseline=timed("html.parser (baseline)",documents,
+                   lambda docs: (baseline_extract(doc,EXTRACT_CLASS,EXCLUDE_CLASSES) for doc in docs))
+    single=ArticleExtractor(EXTRACT_CLASS,EXCLUDE_CLASSES,max_workers=1)
+    timed("lxml, 1 process",documents,single.extract)
+    pooled=ArticleExtractor(EXTRACT_CLASS,EXCLUDE_CLASSES,max_workers=args.workers,min_parallel_pages=0)
+    extracted=timed(f"lxml, {args.workers} processes",documents,pooled.extract)
+    pooled.close()
+    #the process pool yields pages in completion order
+    same=sorted(extracted)==sorted(baseline)
+    print(f"Output identical to the baseline: {same}")
+
+
+if __name__=="__main__":
+    main()
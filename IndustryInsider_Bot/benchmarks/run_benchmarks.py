@@ -0,0 +1,283 @@
+'''Offline end-to-end benchmark: ingestion, index build, retrieval and generation with local model stand-ins'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from functools import partial
+from datetime import datetime, timezone
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+#imported before the environment is configured: it loads .env (override=True) at import time
+import data_loading
+from benchmarks.stand_ins import LocalEmbeddings, LocalChatModel
+from benchmarks.corpus import load_articles, grow_articles, synthetic_chunks, sample_questions
+from instrumentation.telemetry import metrics
+
+
+def rss_bytes():
+    '''Function: To read the resident memory of this process (None where /proc is not available)'''
+    try:
+        with open("/proc/self/statm",'r') as file:
+            return int(file.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError,ValueError,AttributeError):
+        return None
+
+
+def rss_growth(before):
+    '''Function: To compute how much the resident memory grew since before'''
+    after=rss_bytes()
+    return after-before if after is not None and before is not None else None
+
+
+def disk_bytes(path):
+    '''Function: To sum the size of the files below path'''
+    return sum(os.path.getsize(os.path.join(root,name)) for root,_,names in os.walk(path) for name in names)
+
+
+def latency_summary(latencies):
+    '''Function: To summarize latencies in milliseconds'''
+    latencies=np.asarray(latencies)*1000
+    return {"count": int(len(latencies)),"p50_ms": float(np.percentile(latencies,50)),
+            "p99_ms": float(np.percentile(latencies,99)),"mean_ms": float(latencies.mean())}
+
+
+def configure_environment(workspace, output):
+    '''Function: To point every store into the workspace and fill in the settings the live app reads from .env'''
+    os.environ.update({
+        "LOG_DIR": os.path.join(workspace,"logs"),
+        "VECTOR_PATH": os.path.join(workspace,"vectordb"),
+        "KEYWORD_INDEX_PATH": os.path.join(workspace,"keyword_index"),
+        "VECTOR_INDEX_PATH": os.path.join(workspace,"vector_index"),
+        "DEDUP_INDEX_PATH": os.path.join(workspace,"dedup.sqlite3"),
+        "INGESTION_MANIFEST": os.path.join(workspace,"ingestion_manifest.sqlite3"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workspace,"embeddings.sqlite3"),
+        "Data_dir": os.path.join(workspace,"articles"),
+        #every question must reach the retriever and the llm
+        "ANSWER_CACHE_SIMILARITY": "2",
+        #stage metrics are exported next to the results, the workspace is removed at the end
+        "METRICS_EXPORT_PATH": f"{os.path.splitext(output)[0]}.metrics.json",
+    })
+    for key,value in {"EMBEDDING_MODEL": "local-stand-in","HUGGINGFACEHUB_API_TOKEN": "offline","GEMINI_MODEL": "local-stand-in",
+                      "GEMINI_API_KEY": "offline","TIKTOKEN_MODEL": "cl100k_base","FILE_EXTENSION": ".md",
+                      "MAX_CHUNK_TOKENS": "512","MAX_TOKENS": "8192","TOKEN_PROMPT_PADDING": "50",
+                      "TOKEN_HISTORY_PADDING": "4","LOG_FILE_SIZE": str(10*1024*1024)}.items():
+        os.environ.setdefault(key,value)
+
+
+def bench_ingestion(articles, args, embeddings_factory):
+    '''Function: To measure the Data_loading ingestion throughput over a grown article corpus'''
+    grow_articles(articles,args.articles,os.environ["Data_dir"],seed=args.seed)
+    data_loading.HuggingFaceInferenceAPIEmbeddings=embeddings_factory
+    rss_before=rss_bytes()
+    start=time.perf_counter()
+    loader=data_loading.Data_loading()
+    new,changed,_=loader.incremental_ingest()
+    elapsed=time.perf_counter()-start
+    chunks=loader.vector_db._collection.count()
+    return {"articles": len(new)+len(changed),"chunks": chunks,"seconds": elapsed,
+            "articles_per_second": (len(new)+len(changed))/elapsed,"chunks_per_second": chunks/elapsed,
+            "rss_growth_bytes": rss_growth(rss_before),"embedding_cache": loader.EMBEDDINGS.stats(),"dedup": loader.dedup.stats()}
+
+
+def bench_index_build(articles, chunk_count, workspace, embeddings, args):
+    '''Function: To build the BM25, the Chroma and the memory-mapped index of a synthetic corpus, measuring time, memory and disk'''
+    from langchain_community.vectorstores import Chroma
+    from retrieval.keyword_index import KeywordIndex
+    from retrieval.vector_index import MmapVectorIndex, export_from_env
+    index_dir=os.path.join(workspace,f"index_{chunk_count}")
+    keyword_index=KeywordIndex(os.path.join(index_dir,"keyword_index"))
+    rss_before=rss_bytes()
+    start=time.perf_counter()
+    for ids,documents in synthetic_chunks(articles,chunk_count,args.batch_size,args.seed):
+        keyword_index.add_documents(ids,documents)
+    bm25={"seconds": time.perf_counter()-start,"rss_growth_bytes": rss_growth(rss_before),
+          "disk_bytes": disk_bytes(os.path.join(index_dir,"keyword_index"))}
+
+    vector_db=Chroma(persist_directory=os.path.join(index_dir,"vectordb"),embedding_function=embeddings)
+    embed_seconds=0.0
+    rss_before=rss_bytes()
+    start=time.perf_counter()
+    for ids,documents in synthetic_chunks(articles,chunk_count,args.batch_size,args.seed):
+        embed_start=time.perf_counter()
+        vectors=embeddings.embed_documents([document.page_content for document in documents])
+        embed_seconds+=time.perf_counter()-embed_start
+        vector_db._collection.upsert(ids=ids,embeddings=vectors,documents=[document.page_content for document in documents],
+                                     metadatas=[document.metadata for document in documents])
+    chroma={"seconds": time.perf_counter()-start-embed_seconds,"embedding_seconds": embed_seconds,
+            "rss_growth_bytes": rss_growth(rss_before),"disk_bytes": disk_bytes(os.path.join(index_dir,"vectordb"))}
+
+    vector_index_dir=os.path.join(index_dir,"vector_index")
+    start=time.perf_counter()
+    export_from_env(vector_path=os.path.join(index_dir,"vectordb"),index_dir=vector_index_dir).close()
+    export_seconds=time.perf_counter()-start
+    start=time.perf_counter()
+    MmapVectorIndex.open(vector_index_dir).close()
+    vector_index={"export_seconds": export_seconds,"open_seconds": time.perf_counter()-start,"disk_bytes": disk_bytes(vector_index_dir)}
+    return {"chunks": chunk_count,"bm25": bm25,"chroma": chroma,"vector_index": vector_index},vector_db,keyword_index,vector_index_dir
+
+
+def bench_retrieval(vector_db, keyword_index, vector_index_dir, questions):
+    '''Function: To measure the latency distribution of the vector, keyword and hybrid retrievers on Chroma and on the memory-mapped index'''
+    from retrieval.keyword_index import PersistentBM25Retriever
+    from retrieval.hybrid import HybridRetriever
+    from retrieval.vector_index import VectorIndexRetriever
+    vector_retriever=vector_db.as_retriever()
+    keyword_retriever=PersistentBM25Retriever(index=keyword_index,k=5)
+    index_retriever=VectorIndexRetriever.from_env(vector_db.embeddings)
+    index_retriever.index_dir=vector_index_dir
+    retrievers={"vector": vector_retriever,"keyword": keyword_retriever,
+                "hybrid": HybridRetriever.from_env(vector_retriever,keyword_retriever),
+                "vector_index": index_retriever,
+                "hybrid_vector_index": HybridRetriever.from_env(index_retriever,keyword_retriever)}
+    results={}
+    for name,retriever in retrievers.items():
+        latencies=[]
+        for question in questions:
+            start=time.perf_counter()
+            retriever.invoke(question)
+            latencies.append(time.perf_counter()-start)
+        results[name]=latency_summary(latencies)
+    start=time.perf_counter()
+    batched=index_retriever.search_batch(questions)
+    results["vector_index_batch_ms_per_query"]=(time.perf_counter()-start)*1000/max(len(questions),1)
+    results["recall"]={"vector": vector_recall(vector_db,questions,[vector_retriever.invoke(question) for question in questions]),
+                       "vector_index": vector_recall(vector_db,questions,batched)}
+    return results
+
+
+def vector_recall(vector_db, questions, retrieved):
+    '''Function: To compute the share of retrieved documents scoring at least like the k-th exact nearest neighbour'''
+    data=vector_db._collection.get(include=["embeddings","documents"])
+    vectors=np.asarray(data["embeddings"],dtype=np.float32)
+    vectors/=np.linalg.norm(vectors,axis=1,keepdims=True)
+    recalls=[]
+    for question,documents in zip(questions,retrieved):
+        if not documents:
+            continue
+        query=np.asarray(vector_db.embeddings.embed_query(question),dtype=np.float32)
+        scores=vectors@(query/np.linalg.norm(query))
+        #ties are common, a document is a hit when it scores like the exact top k
+        threshold=np.sort(scores)[-len(documents)]-1e-4
+        scores_by_content=dict(zip(data["documents"],scores))
+        recalls.append(np.mean([scores_by_content[document.page_content]>=threshold for document in documents]))
+    return float(np.mean(recalls)) if recalls else None
+
+
+def bench_generation(questions, embeddings_factory, llm_factory):
+    '''Function: To measure time to first token and tokens/second of the streamed responses'''
+    from langchain_community.chat_message_histories import ChatMessageHistory
+    from chatstore.token_ledger import TokenLedger
+    from serving import resources as serving_resources
+    serving_resources.HuggingFaceInferenceAPIEmbeddings=embeddings_factory
+    serving_resources.ChatGoogleGenerativeAI=llm_factory
+    resources=serving_resources.AppResources()
+    startup=resources.warm_up()
+    first_token,tokens_per_second=[],[]
+    for question in questions:
+        #same call generate_response makes for every turn
+        ledger=TokenLedger(resources.encoding,int(os.environ["TOKEN_HISTORY_PADDING"]))
+        start=time.perf_counter()
+        first=None
+        response=""
+        for answer_chunk in resources.rag_pipeline.stream(question,ChatMessageHistory(),ledger):
+            if first is None:
+                first=time.perf_counter()
+            response+=answer_chunk
+        end=time.perf_counter()
+        if first is None:
+            continue
+        first_token.append(first-start)
+        if end>first:
+            tokens_per_second.append(len(resources.encoding.encode(response))/(end-first))
+    return {"startup_seconds": startup["elapsed_seconds"],"time_to_first_token": latency_summary(first_token),
+            "tokens_per_second_mean": float(np.mean(tokens_per_second)) if tokens_per_second else None,
+            "query_condenser": resources.query_condenser.stats()}
+
+
+def git_commit():
+    '''Function: To identify the benchmarked code'''
+    try:
+        return subprocess.run(["git","rev-parse","HEAD"],capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    '''Function: To print the relative change of every numeric result against a previous run'''
+    with open(baseline_path,'r',encoding='utf-8') as file:
+        baseline=json.load(file)
+    def walk(current, previous, path):
+        if isinstance(current,dict) and isinstance(previous,dict):
+            for key in current:
+                if key in previous:
+                    walk(current[key],previous[key],f"{path}.{key}" if path else key)
+        elif isinstance(current,list) and isinstance(previous,list):
+            for index,(item,previous_item) in enumerate(zip(current,previous)):
+                walk(item,previous_item,f"{path}[{index}]")
+        elif isinstance(current,(int,float)) and isinstance(previous,(int,float)) and not isinstance(current,bool) and previous:
+            print(f"{path:<60}{previous:>14.3f}{current:>14.3f}{(current-previous)/previous:>+9.1%}")
+    walk(results,baseline,"")
+
+
+def main():
+    '''Main function'''
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles-dir",default="./data/Articles")
+    parser.add_argument("--articles",type=int,default=200,help="synthetic articles ingested through Data_loading")
+    parser.add_argument("--chunks",type=int,nargs="+",default=[10000],help="synthetic corpus sizes for index build and retrieval")
+    parser.add_argument("--queries",type=int,default=200)
+    parser.add_argument("--questions",type=int,default=50,help="questions streamed through the rag pipeline")
+    parser.add_argument("--batch-size",type=int,default=1000)
+    parser.add_argument("--embedding-call-latency",type=float,default=0.05,help="simulated seconds per embedding API call")
+    parser.add_argument("--embedding-text-latency",type=float,default=0.0005,help="simulated seconds per embedded text")
+    parser.add_argument("--llm-first-token-latency",type=float,default=0.4)
+    parser.add_argument("--llm-token-latency",type=float,default=0.01)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--output",default="./benchmark_results.json")
+    parser.add_argument("--baseline",help="previous results json to compare against")
+    parser.add_argument("--keep-workspace",action="store_true")
+    args=parser.parse_args()
+
+    articles=load_articles(args.articles_dir)
+    workspace=tempfile.mkdtemp(prefix="industryinsider_bench_")
+    configure_environment(workspace,args.output)
+    embeddings_factory=partial(LocalEmbeddings,call_latency=args.embedding_call_latency,text_latency=args.embedding_text_latency)
+    llm_factory=partial(LocalChatModel,first_token_latency=args.llm_first_token_latency,token_latency=args.llm_token_latency)
+    results={"run": {"timestamp": datetime.now(timezone.utc).isoformat(),"git_commit": git_commit(),
+                     "python": platform.python_version(),"platform": platform.platform(),"arguments": vars(args)}}
+    try:
+        results["ingestion"]=bench_ingestion(articles,args,embeddings_factory)
+        print(f"Ingestion: {results['ingestion']['chunks_per_second']:.1f} chunks/s")
+        questions=sample_questions(articles,args.queries,seed=args.seed)
+        results["index_build"],results["retrieval"]=[],[]
+        for chunk_count in args.chunks:
+            build,vector_db,keyword_index,vector_index_dir=bench_index_build(articles,chunk_count,workspace,embeddings_factory(),args)
+            results["index_build"].append(build)
+            retrieval=bench_retrieval(vector_db,keyword_index,vector_index_dir,questions)
+            results["retrieval"].append({"chunks": chunk_count,**retrieval})
+            print(f"{chunk_count} chunks: bm25 build {build['bm25']['seconds']:.1f}s, chroma build {build['chroma']['seconds']:.1f}s, "
+                  f"hybrid p50 {retrieval['hybrid']['p50_ms']:.1f}ms p99 {retrieval['hybrid']['p99_ms']:.1f}ms, "
+                  f"vector p50 chroma {retrieval['vector']['p50_ms']:.1f}ms / mmap {retrieval['vector_index']['p50_ms']:.1f}ms")
+        results["generation"]=bench_generation(questions[:args.questions],embeddings_factory,llm_factory)
+        print(f"Generation: time to first token p50 {results['generation']['time_to_first_token']['p50_ms']:.1f}ms")
+        results["stage_metrics"]=metrics.snapshot()
+    finally:
+        if not args.keep_workspace:
+            shutil.rmtree(workspace,ignore_errors=True)
+    with open(args.output,'w',encoding='utf-8') as file:
+        json.dump(results,file,indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        compare(results,args.baseline)
+
+
+if __name__=="__main__":
+    main()
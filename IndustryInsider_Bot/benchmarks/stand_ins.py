@@ -0,0 +1,93 @@
+'''Deterministic local stand-ins for the HuggingFace embeddings and the Gemini chat model, with simulated latency'''
+import re
+import time
+import zlib
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORD_PATTERN=re.compile(r"\w+")
+
+
+class LocalEmbeddings(Embeddings):
+    '''Stand-in for HuggingFaceInferenceAPIEmbeddings: hashed bag-of-words vectors, same text gives the same vector'''
+    def __init__(self, api_key=None, model_name=None, dimensions=384, call_latency=0.0, text_latency=0.0):
+        '''Constructor for initialization, accepts the arguments of the real embedding class'''
+        self.model_name=model_name
+        self.dimensions=dimensions
+        #simulated round trip of one API call and extra time per embedded text
+        self.call_latency=call_latency
+        self.text_latency=text_latency
+        self.calls=0
+        self.texts=0
+
+    def _vector(self, text):
+        '''Function: To hash the words of the text into a normalized vector'''
+        vector=np.zeros(self.dimensions,dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            bucket=zlib.crc32(word.encode("utf-8"))
+            vector[bucket%self.dimensions]+=1.0 if bucket&0x80000000 else -1.0
+        norm=np.linalg.norm(vector)
+        return (vector/norm if norm else vector).tolist()
+
+    def _simulate(self, count):
+        '''Function: To sleep as long as the remote call would take'''
+        self.calls+=1
+        self.texts+=count
+        delay=self.call_latency+self.text_latency*count
+        if delay>0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        '''Function: To embed a batch of texts'''
+        self._simulate(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        '''Function: To embed a query'''
+        self._simulate(1)
+        return self._vector(text)
+
+
+class LocalChatModel(BaseChatModel):
+    '''Stand-in for ChatGoogleGenerativeAI: streams a deterministic answer with simulated first token and per token delays'''
+    model: str="local"
+    google_api_key: Optional[str]=None
+    temperature: float=0
+    first_token_latency: float=0.0
+    token_latency: float=0.0
+    answer_tokens: int=128
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-stand-in"
+
+    def _answer_words(self, messages, generation_config=None):
+        '''Function: To build the answer from the words of the prompt, capped like max_output_tokens would'''
+        max_tokens=self.answer_tokens
+        if generation_config and generation_config.get("max_output_tokens"):
+            max_tokens=min(max_tokens,generation_config["max_output_tokens"])
+        words=WORD_PATTERN.findall(" ".join(str(message.content) for message in messages)) or ["answer"]
+        return [words[index%len(words)] for index in range(max_tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]]=None, run_manager: Any=None, **kwargs: Any) -> ChatResult:
+        '''Function: To return the whole answer at once'''
+        words=self._answer_words(messages,kwargs.get("generation_config"))
+        time.sleep(self.first_token_latency+self.token_latency*max(len(words)-1,0))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(words)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]]=None, run_manager: Any=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        '''Function: To stream the answer word by word'''
+        words=self._answer_words(messages,kwargs.get("generation_config"))
+        time.sleep(self.first_token_latency)
+        for index,word in enumerate(words):
+            if index:
+                time.sleep(self.token_latency)
+            chunk=ChatGenerationChunk(message=AIMessageChunk(content=word if index==0 else " "+word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text,chunk=chunk)
+            yield chunk
@@ -0,0 +1,87 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache():
+    '''Class to cache generated answers keyed on the embedding of the standalone question'''
+    def __init__(self, embeddings, similarity_threshold=0.95, ttl_seconds=24*3600, max_entries=1000):
+        '''Constructor for initialization'''
+        self.embeddings=embeddings
+        self.similarity_threshold=similarity_threshold
+        self.ttl_seconds=ttl_seconds
+        self.max_entries=max_entries
+        #entry id -> (normalized question vector, question, answer, created_at), kept in LRU order
+        self._entries=OrderedDict()
+        self._next_id=0
+        self._version=None
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+
+    @classmethod
+    def from_env(cls, embeddings):
+        '''Function: To create the cache using the settings from the environment'''
+        return cls(embeddings,
+                   similarity_threshold=float(os.environ.get("ANSWER_CACHE_SIMILARITY","0.95")),
+                   ttl_seconds=int(os.environ.get("ANSWER_CACHE_TTL","86400")),
+                   max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES","1000")))
+
+    def _embed(self, question):
+        '''Function: To embed and normalize the question'''
+        vector=np.asarray(self.embeddings.embed_query(question),dtype=np.float32)
+        norm=np.linalg.norm(vector)
+        return vector/norm if norm else vector
+
+    def _check_version(self, version):
+        '''Function: To drop every entry once new articles were ingested'''
+        if version!=self._version:
+            self._entries.clear()
+            self._version=version
+
+    def lookup(self, question, version):
+        '''Function: To return the cached answer of the most similar question, if similar enough'''
+        vector=self._embed(question)
+        now=time.time()
+        with self._lock:
+            self._check_version(version)
+            expired=[entry_id for entry_id,entry in self._entries.items() if now-entry[3]>self.ttl_seconds]
+            for entry_id in expired:
+                del self._entries[entry_id]
+            if self._entries:
+                entry_ids=list(self._entries)
+                matrix=np.stack([self._entries[entry_id][0] for entry_id in entry_ids])
+                similarities=matrix@vector
+                best=int(np.argmax(similarities))
+                if similarities[best]>=self.similarity_threshold:
+                    self._entries.move_to_end(entry_ids[best])
+                    self.hits+=1
+                    return self._entries[entry_ids[best]][2]
+            self.misses+=1
+        return None
+
+    def store(self, question, answer, version):
+        '''Function: To cache the answer of a question'''
+        if not answer:
+            return
+        vector=self._embed(question)
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_id]=(vector,question,answer,time.time())
+            self._next_id+=1
+            while len(self._entries)>self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def replay(answer):
+        '''Function: To stream a cached answer back in word sized chunks like the LLM does'''
+        for chunk in re.findall(r"\S+\s*|\s+",answer):
+            yield chunk
+
+    def stats(self):
+        '''Function: To report the hit/miss counters and the number of cached answers'''
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,174 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    '''Class to wrap an embedding model with a persistent, size bounded (LRU) cache'''
+    def __init__(self, embeddings, model_name, cache_path, max_bytes=512*1024*1024, batch_size=64):
+        '''Constructor for initialization'''
+        self.embeddings=embeddings
+        self.model_name=model_name
+        self.max_bytes=max_bytes
+        self.batch_size=batch_size
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+        cache_dir=os.path.dirname(os.path.abspath(cache_path))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        #the cache file is shared by the loader, the app and the API server, writers wait for each other
+        self._conn=sqlite3.connect(cache_path,check_same_thread=False,timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns=[row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if columns and "kind" not in columns:
+            #caches written before queries had their own key space are dropped, they only cost re-embedding
+            self._conn.execute("DROP TABLE embeddings")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings(
+            model TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY(model,kind,text_hash))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        #the size of the cache is kept in the database so every process sharing it evicts on the same total
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta SELECT 'total_bytes', COALESCE(SUM(LENGTH(vector)),0) FROM embeddings")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, embeddings):
+        '''Function: To wrap the embedding model using the cache settings from the environment'''
+        return cls(embeddings,
+                   model_name=os.environ["EMBEDDING_MODEL"],
+                   cache_path=os.environ.get("EMBEDDING_CACHE_PATH","./cache/embeddings.sqlite3"),
+                   max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES",str(512*1024*1024))),
+                   batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE","64")))
+
+    @staticmethod
+    def text_hash(text):
+        '''Function: To compute the cache key of a text'''
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys, kind="document"):
+        '''Function: To fetch cached vectors for the given keys and refresh their access time'''
+        found={}
+        unique_keys=list(set(keys))
+        for start in range(0,len(unique_keys),500):
+            batch=unique_keys[start:start+500]
+            rows=self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model=? AND kind=? AND text_hash IN ({','.join('?'*len(batch))})",
+                [self.model_name,kind,*batch]).fetchall()
+            for text_hash,blob in rows:
+                vector=array('f')
+                vector.frombytes(blob)
+                found[text_hash]=vector.tolist()
+        if found:
+            now=time.time()
+            self._conn.executemany("UPDATE embeddings SET last_access=? WHERE model=? AND kind=? AND text_hash=?",
+                                   [(now,self.model_name,kind,text_hash) for text_hash in found])
+        return found
+
+    def _total_bytes(self):
+        '''Function: To read the size of the cache shared by all processes'''
+        return self._conn.execute("SELECT value FROM meta WHERE key='total_bytes'").fetchone()[0]
+
+    def _store(self, items, kind="document"):
+        '''Function: To persist newly computed vectors and evict the least recently used ones, in one write transaction'''
+        now=time.time()
+        rows={text_hash: (self.model_name,kind,text_hash,array('f',vector).tobytes(),now) for text_hash,vector in items}
+        #the write lock is taken before reading the replaced sizes so no other process changes them in between
+        self._conn.execute("BEGIN IMMEDIATE")
+        #rows replaced after a concurrent miss on the same text must not be counted twice
+        replaced=self._lookup_sizes(list(rows),kind)
+        self._conn.executemany("INSERT OR REPLACE INTO embeddings(model,kind,text_hash,vector,last_access) VALUES(?,?,?,?,?)",list(rows.values()))
+        self._conn.execute("UPDATE meta SET value=value+? WHERE key='total_bytes'",(sum(len(row[3]) for row in rows.values())-replaced,))
+        if self._total_bytes()>self.max_bytes:
+            self._evict()
+
+    def _lookup_sizes(self, keys, kind):
+        '''Function: To sum the sizes of the vectors already stored for the given keys'''
+        total=0
+        for start in range(0,len(keys),500):
+            batch=keys[start:start+500]
+            total+=self._conn.execute(
+                f"SELECT COALESCE(SUM(LENGTH(vector)),0) FROM embeddings WHERE model=? AND kind=? AND text_hash IN ({','.join('?'*len(batch))})",
+                [self.model_name,kind,*batch]).fetchone()[0]
+        return total
+
+    def _evict(self):
+        '''Function: To delete least recently used vectors until the cache fits in max_bytes'''
+        target=int(self.max_bytes*0.9)
+        total_bytes=self._total_bytes()
+        cursor=self._conn.execute("SELECT model, kind, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_access")
+        to_delete=[]
+        for model,kind,text_hash,size in cursor:
+            if total_bytes<=target:
+                break
+            to_delete.append((model,kind,text_hash))
+            total_bytes-=size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE model=? AND kind=? AND text_hash=?",to_delete)
+        self._conn.execute("UPDATE meta SET value=? WHERE key='total_bytes'",(total_bytes,))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        '''Function: To embed texts, calling the model only for cache misses in bulk batches'''
+        keys=[self.text_hash(text) for text in texts]
+        with self._lock:
+            found=self._lookup(keys)
+            self._conn.commit()
+        missing={}
+        for key,text in zip(keys,texts):
+            if key not in found and key not in missing:
+                missing[key]=text
+        missing_items=list(missing.items())
+        #the model is called outside the lock so parallel workers are not serialized
+        for start in range(0,len(missing_items),self.batch_size):
+            batch=missing_items[start:start+self.batch_size]
+            vectors=self.embeddings.embed_documents([text for _,text in batch])
+            computed=[(key,vector) for (key,_),vector in zip(batch,vectors)]
+            with self._lock:
+                self._store(computed)
+                self._conn.commit()
+            found.update(computed)
+        with self._lock:
+            self.hits+=len(texts)-sum(1 for key in keys if key in missing)
+            self.misses+=len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        '''Function: To embed a single query through the cache'''
+        #queries are kept apart from documents as some models embed them differently
+        key=self.text_hash(text)
+        with self._lock:
+            found=self._lookup([key],kind="query")
+            self._conn.commit()
+            if key in found:
+                self.hits+=1
+                return found[key]
+            self.misses+=1
+        vector=self.embeddings.embed_query(text)
+        with self._lock:
+            self._store([(key,vector)],kind="query")
+            self._conn.commit()
+        return vector
+
+    def stats(self):
+        '''Function: To report the hit/miss counters and the size of the cache'''
+        total=self.hits+self.misses
+        with self._lock:
+            size_bytes=self._total_bytes()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits/total,4) if total else 0.0,
+            "size_bytes": size_bytes,
+        }
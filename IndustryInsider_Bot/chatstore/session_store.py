@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, message_to_dict
+
+
+class SessionHistory(BaseChatMessageHistory):
+    '''Chat history of one session: the recent window in memory, new messages pending until persisted'''
+    def __init__(self, session_id, messages=None):
+        '''Constructor for initialization'''
+        self.session_id=session_id
+        self.messages: List[BaseMessage]=messages or []
+        #messages added since the last persist, always the newest ones
+        self.pending: List[BaseMessage]=[]
+        self.cleared=False
+
+    def add_message(self, message: BaseMessage) -> None:
+        '''Function: To add a message to the session'''
+        self.messages.append(message)
+        self.pending.append(message)
+
+    def clear(self) -> None:
+        '''Function: To start the conversation again'''
+        self.messages.clear()
+        self.pending.clear()
+        self.cleared=True
+
+
+class Session():
+    '''Class to hold the history and token ledger of a session in the hot tier'''
+    def __init__(self, history, ledger, last_seq):
+        '''Constructor for initialization'''
+        self.history=history
+        self.ledger=ledger
+        #sequence number of the newest stored message, to notice writes by other processes
+        self.last_seq=last_seq
+        self.last_access=time.time()
+
+
+class SessionStore():
+    '''Class to keep per-user chat sessions in SQLite with a bounded LRU hot tier in memory'''
+    def __init__(self, store_path, ledger_factory, cache_size=1000, idle_seconds=1800, ttl_seconds=7*24*3600,
+                 window_tokens=4096, window_messages=50):
+        '''Constructor for initialization'''
+        store_dir=os.path.dirname(os.path.abspath(store_path))
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        #creates an empty TokenLedger for a session
+        self.ledger_factory=ledger_factory
+        self.cache_size=cache_size
+        self.idle_seconds=idle_seconds
+        self.ttl_seconds=ttl_seconds
+        #only the most recent messages within these limits are loaded, older turns would be truncated anyway
+        self.window_tokens=window_tokens
+        self.window_messages=window_messages
+        self._sessions=OrderedDict()
+        self._lock=threading.Lock()
+        self._last_expiry=0.0
+        self._conn=sqlite3.connect(store_path,check_same_thread=False,timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions(
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                token_total INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access);
+            CREATE TABLE IF NOT EXISTS messages(
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                token_count INTEGER NOT NULL,
+                PRIMARY KEY(session_id,seq)) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, ledger_factory):
+        '''Function: To open the session store configured in the environment'''
+        return cls(os.environ.get("SESSION_STORE_PATH","./cache/sessions.sqlite3"),ledger_factory,
+                   cache_size=int(os.environ.get("SESSION_CACHE_SIZE","1000")),
+                   idle_seconds=int(os.environ.get("SESSION_IDLE_SECONDS","1800")),
+                   ttl_seconds=int(os.environ.get("SESSION_TTL_SECONDS",str(7*24*3600))),
+                   window_tokens=int(os.environ.get("SESSION_WINDOW_TOKENS","4096")),
+                   window_messages=int(os.environ.get("SESSION_WINDOW_MESSAGES","50")))
+
+    def _stored_seq(self, session_id):
+        '''Function: To read the sequence number of the newest stored message of a session'''
+        row=self._conn.execute("SELECT last_seq FROM sessions WHERE session_id=?",(session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _load(self, session_id):
+        '''Function: To load the recent window of a session, seeding its ledger with the stored token counts'''
+        ledger=self.ledger_factory()
+        rows=self._conn.execute("SELECT message, token_count FROM messages WHERE session_id=? ORDER BY seq DESC LIMIT ?",
+                                (session_id,self.window_messages)).fetchall()
+        window,tokens=[],0
+        for message,token_count in rows:
+            if tokens+token_count+ledger.padding>self.window_tokens:
+                break
+            window.append((message,token_count))
+            tokens+=token_count+ledger.padding
+        window.reverse()
+        #the window starts with a question so question/answer pairs stay together
+        if len(window)%2:
+            window=window[1:]
+        messages=messages_from_dict([json.loads(message) for message,_ in window])
+        for _,token_count in window:
+            ledger.add(token_count)
+        return Session(SessionHistory(session_id,messages),ledger,self._stored_seq(session_id))
+
+    def _evict(self, now):
+        '''Function: To drop idle sessions and the least recently used ones beyond the hot tier size'''
+        while self._sessions:
+            session_id,session=next(iter(self._sessions.items()))
+            if len(self._sessions)<=self.cache_size and now-session.last_access<=self.idle_seconds:
+                break
+            #sessions are persisted after every turn, dropping them loses nothing
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        '''Function: To return the session from the hot tier, reloading it if another process wrote to it'''
+        session_id=str(session_id)
+        now=time.time()
+        with self._lock:
+            session=self._sessions.get(session_id)
+            if session is not None and session.last_seq!=self._stored_seq(session_id):
+                session=None
+            if session is None:
+                session=self._load(session_id)
+                self._sessions[session_id]=session
+            self._sessions.move_to_end(session_id)
+            session.last_access=now
+            self._evict(now)
+            if now-self._last_expiry>min(self.idle_seconds,3600):
+                self._expire(now)
+        return session
+
+    def persist(self, session):
+        '''Function: To write the messages added since the last persist along with their token counts'''
+        history,ledger=session.history,session.ledger
+        session_id=history.session_id
+        with self._lock:
+            now=time.time()
+            with self._conn:
+                cleared=history.cleared
+                if cleared:
+                    self._conn.execute("DELETE FROM messages WHERE session_id=?",(session_id,))
+                    ledger.clear()
+                    history.cleared=False
+                pending=history.pending
+                #the ledger is synced with the history at the end of every turn, so the newest counts belong to the pending messages
+                counts=[count-ledger.padding for count in list(ledger.counts)[-len(pending):]] if pending else []
+                if len(counts)<len(pending):
+                    counts=[ledger.count(message.content) for message in pending]
+                self._conn.execute("INSERT OR IGNORE INTO sessions(session_id,created_at,last_access) VALUES(?,?,?)",(session_id,now,now))
+                #a cleared session moves its sequence on as well, so other processes reload it
+                last_seq=self._conn.execute("SELECT last_seq FROM sessions WHERE session_id=?",(session_id,)).fetchone()[0]+int(cleared)
+                self._conn.executemany("INSERT INTO messages VALUES(?,?,?,?)",
+                                       [(session_id,last_seq+index+1,json.dumps(message_to_dict(message)),count)
+                                        for index,(message,count) in enumerate(zip(pending,counts))])
+                self._conn.execute("UPDATE sessions SET last_access=?, last_seq=?, token_total=(SELECT COALESCE(SUM(token_count),0) FROM messages WHERE session_id=?) WHERE session_id=?",
+                                   (now,last_seq+len(pending),session_id,session_id))
+            session.last_seq=last_seq+len(pending)
+            history.pending=[]
+
+    def _expire(self, now):
+        '''Function: To delete the sessions not used within the TTL'''
+        self._last_expiry=now
+        cutoff=now-self.ttl_seconds
+        with self._conn:
+            self._conn.execute("DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_access<?)",(cutoff,))
+            expired=self._conn.execute("DELETE FROM sessions WHERE last_access<?",(cutoff,)).rowcount
+        return expired
+
+    def stats(self):
+        '''Function: To report the hot tier size and the number of stored sessions'''
+        with self._lock:
+            stored=self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {"hot_sessions": len(self._sessions),"stored_sessions": stored}
@@ -0,0 +1,75 @@
+import os
+from collections import deque, namedtuple
+
+TokenBudget=namedtuple("TokenBudget",["history","context","output"])
+
+
+class TokenLedger():
+    '''Class to keep the token count of every message of a session so each message is encoded only once'''
+    def __init__(self, encoding, padding):
+        '''Constructor for initialization'''
+        self.encoding=encoding
+        #padding added per message for the conversation narrative eg. AI message and Human
+        self.padding=padding
+        self.counts=deque()
+        self.total=0
+
+    def count(self, text):
+        '''Function: To count the tokens of a new text'''
+        return len(self.encoding.encode(text))
+
+    def add(self, token_count):
+        '''Function: To record the already known token count of the next message'''
+        self.counts.append(token_count+self.padding)
+        self.total+=token_count+self.padding
+
+    def sync(self, messages):
+        '''Function: To count only the messages which were added to the history since the last sync'''
+        if len(messages)<len(self.counts):
+            #history was cleared or truncated outside the ledger
+            self.clear()
+        for message in list(messages)[len(self.counts):]:
+            self.add(self.count(message.content))
+        return self.total
+
+    def drop_oldest(self, count=2):
+        '''Function: To forget the oldest messages (question and answer pair by default)'''
+        for _ in range(min(count,len(self.counts))):
+            self.total-=self.counts.popleft()
+
+    def clear(self):
+        '''Function: To reset the ledger'''
+        self.counts.clear()
+        self.total=0
+
+
+class BudgetAllocator():
+    '''Class to divide MAX_TOKENS between chat history, retrieved context and the response'''
+    def __init__(self, max_tokens, template_tokens, prompt_padding, history_share=0.3, output_share=0.3, min_output_tokens=256):
+        '''Constructor for initialization'''
+        self.max_tokens=max_tokens
+        #token length of the prompt templates is fixed, computed once at startup
+        self.template_tokens=template_tokens
+        self.prompt_padding=prompt_padding
+        self.history_share=history_share
+        self.output_share=output_share
+        self.min_output_tokens=min_output_tokens
+
+    @classmethod
+    def from_env(cls, template_tokens):
+        '''Function: To create the allocator using the token settings from the environment'''
+        return cls(int(os.environ["MAX_TOKENS"]),
+                   template_tokens,
+                   int(os.environ["TOKEN_PROMPT_PADDING"]),
+                   history_share=float(os.environ.get("HISTORY_TOKEN_SHARE","0.3")),
+                   output_share=float(os.environ.get("OUTPUT_TOKEN_SHARE","0.3")),
+                   min_output_tokens=int(os.environ.get("MIN_OUTPUT_TOKENS","256")))
+
+    def allocate(self, history_tokens, question_tokens):
+        '''Function: To compute the history, context and output budgets for a question'''
+        available=max(self.max_tokens-self.template_tokens-self.prompt_padding-question_tokens,0)
+        output=min(max(int(available*self.output_share),self.min_output_tokens),available)
+        history=min(history_tokens,int(available*self.history_share),available-output)
+        #whatever history does not use is left for the retrieved context
+        context=available-history-output
+        return TokenBudget(history=history,context=context,output=output)
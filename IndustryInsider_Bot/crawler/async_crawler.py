@@ -0,0 +1,309 @@
+import os
+import re
+import html
+import json
+import time
+import queue
+import random
+import inspect
+import asyncio
+import logging
+import threading
+from collections import deque
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+from requests_html import HTML
+from langchain_core.documents import Document
+
+from crawler.frontier import CrawlFrontier
+from instrumentation.telemetry import metrics
+
+RETRY_STATUSES={429,500,502,503,504}
+TITLE_PATTERN=re.compile(r"<title[^>]*>(.*?)</title>",re.IGNORECASE|re.DOTALL)
+
+
+def filter_article_links(links, base_url, url_prefix):
+    '''Function: To convert links into absolute links and keep only the article links below the base url'''
+    valid_links=[]
+    for link in links:
+        absolute_link=urljoin(url_prefix,link)
+        path_parts=urlparse(absolute_link).path.split('/')
+        if absolute_link.startswith(base_url) and len(path_parts)>=2 and path_parts[-2]=="articleshow":
+            valid_links.append(absolute_link)
+    return valid_links
+
+
+def render_page(driver, url, page_timeout=30, scroll_timeout=4, scroll_step=3000):
+    '''Function: To load a page in the browser and scroll till the end, waiting on the DOM instead of fixed sleeps'''
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+    driver.get(url)
+    #wait till the page (and its redirect) has been loaded
+    WebDriverWait(driver,page_timeout,poll_frequency=0.2).until(
+        lambda d: d.execute_script("return document.readyState")=="complete")
+    last_height=driver.execute_script("return document.body.scrollHeight")
+    while True:
+        driver.execute_script(f"window.scrollBy(0,{scroll_step})")
+        try:
+            #wait only as long as the page takes to append more content
+            WebDriverWait(driver,scroll_timeout,poll_frequency=0.2).until(
+                lambda d: d.execute_script("return document.body.scrollHeight")!=last_height)
+        except TimeoutException:
+            #when reached the end stop scrolling
+            break
+        last_height=driver.execute_script("return document.body.scrollHeight")
+    return driver.page_source
+
+
+class BrowserPool():
+    '''Class to keep a small pool of reusable headless browsers for pages which need JavaScript'''
+    def __init__(self, size=2, page_timeout=30, scroll_timeout=4):
+        '''Constructor for initialization'''
+        self.size=size
+        self.page_timeout=page_timeout
+        self.scroll_timeout=scroll_timeout
+        self._idle=queue.Queue()
+        self._created=0
+        self._lock=threading.Lock()
+        self._drivers=[]
+
+    def _new_driver(self):
+        '''Function: To start a new headless browser'''
+        from selenium import webdriver
+        options=webdriver.ChromeOptions()
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")
+        driver=webdriver.Chrome(options=options)
+        self._drivers.append(driver)
+        return driver
+
+    def render(self, url):
+        '''Function: To render a page with an idle browser from the pool (blocking)'''
+        with self._lock:
+            if self._idle.empty() and self._created<self.size:
+                self._created+=1
+                self._idle.put(self._new_driver())
+        driver=self._idle.get()
+        try:
+            return render_page(driver,url,self.page_timeout,self.scroll_timeout)
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        '''Function: To quit all browsers'''
+        for driver in self._drivers:
+            driver.quit()
+        self._drivers=[]
+        self._created=0
+        self._idle=queue.Queue()
+
+
+class HostRateLimiter():
+    '''Class to space out the requests sent to each host'''
+    def __init__(self, requests_per_second):
+        '''Constructor for initialization'''
+        self.min_interval=1.0/requests_per_second if requests_per_second>0 else 0.0
+        self._next_slot={}
+        self._locks={}
+
+    async def wait(self, host):
+        '''Function: To wait for the next free request slot of the host'''
+        lock=self._locks.setdefault(host,asyncio.Lock())
+        async with lock:
+            now=time.monotonic()
+            next_slot=self._next_slot.get(host,now)
+            if next_slot>now:
+                await asyncio.sleep(next_slot-now)
+            self._next_slot[host]=max(now,next_slot)+self.min_interval
+
+
+class AsyncCrawler():
+    '''Class to crawl listing pages and articles concurrently on asyncio'''
+    def __init__(self, url_prefix, logger=None, max_connections=20, per_host_connections=8, requests_per_second=5.0,
+                 max_retries=3, backoff=0.5, timeout=30, browser_pool=None, validators_path=None, min_static_links=1, frontier=None,
+                 max_in_flight=None):
+        '''Constructor for initialization'''
+        self.url_prefix=url_prefix
+        self.logger=logger or logging.getLogger(__name__)
+        self.max_connections=max_connections
+        #articles fetched concurrently, pages held in memory are bounded by this and not by the crawl size
+        self.max_in_flight=max_in_flight or 2*max_connections
+        self.per_host_connections=per_host_connections
+        self.rate_limiter=HostRateLimiter(requests_per_second)
+        self.max_retries=max_retries
+        self.backoff=backoff
+        self.timeout=timeout
+        self.browser_pool=browser_pool
+        #listing pages with fewer links than this in their static html are rendered in the browser
+        self.min_static_links=min_static_links
+        self.validators_path=validators_path
+        #listing url -> {"etag":..., "last_modified":...} used for conditional GETs, articles are filtered by the frontier instead
+        self.validators=self._load_validators()
+        #seen-URL index shared with the legacy loader
+        self.frontier=frontier if frontier is not None else CrawlFrontier.from_env()
+        self.stats={"fetched": 0, "not_modified": 0, "retries": 0, "failed": 0, "rendered": 0}
+
+    @classmethod
+    def from_env(cls, url_prefix, logger=None, frontier=None):
+        '''Function: To create the crawler using the settings from the environment'''
+        browser_pool=None
+        if os.environ.get("CRAWLER_BROWSER","1")=="1":
+            browser_pool=BrowserPool(size=int(os.environ.get("CRAWLER_BROWSERS","2")))
+        return cls(url_prefix,logger,
+                   max_connections=int(os.environ.get("CRAWLER_MAX_CONNECTIONS","20")),
+                   per_host_connections=int(os.environ.get("CRAWLER_PER_HOST_CONNECTIONS","8")),
+                   requests_per_second=float(os.environ.get("CRAWLER_REQUESTS_PER_SECOND","5")),
+                   max_retries=int(os.environ.get("CRAWLER_MAX_RETRIES","3")),
+                   max_in_flight=int(os.environ.get("CRAWLER_MAX_IN_FLIGHT","0")) or None,
+                   browser_pool=browser_pool,
+                   validators_path=os.environ.get("CRAWLER_VALIDATORS_PATH","./cache/http_validators.json"),
+                   frontier=frontier)
+
+    def _load_validators(self):
+        '''Function: To load the ETag/Last-Modified validators of the previous crawl'''
+        if self.validators_path and os.path.exists(self.validators_path):
+            with open(self.validators_path,'r',encoding="utf-8") as file:
+                return json.load(file)
+        return {}
+
+    def _save_validators(self, base_urls):
+        '''Function: To persist the ETag/Last-Modified validators of the crawled listing pages for the next crawl'''
+        if not self.validators_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.validators_path)),exist_ok=True)
+        #entries of other urls (article urls stored by older crawls) are dropped
+        self.validators={url: self.validators[url] for url in base_urls if url in self.validators}
+        with open(self.validators_path,'w',encoding="utf-8") as file:
+            json.dump(self.validators,file)
+
+    async def fetch(self, session, url, conditional=False):
+        '''Function: To GET a url with rate limiting and retries with backoff, conditional GETs return None if not modified'''
+        headers={}
+        validator=self.validators.get(url,{}) if conditional else {}
+        if validator.get("etag"):
+            headers["If-None-Match"]=validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"]=validator["last_modified"]
+        host=urlparse(url).netloc
+        for attempt in range(self.max_retries+1):
+            await self.rate_limiter.wait(host)
+            retry_after=None
+            try:
+                async with session.get(url,headers=headers) as response:
+                    if response.status==304 and headers:
+                        self.stats["not_modified"]+=1
+                        return None
+                    #a 304 to an unconditional GET has no body to hand over, the page is fetched again in full
+                    if response.status not in RETRY_STATUSES and response.status!=304:
+                        response.raise_for_status()
+                        text=await response.text()
+                        if conditional:
+                            self.validators[url]={"etag": response.headers.get("ETag"),
+                                                  "last_modified": response.headers.get("Last-Modified")}
+                        self.stats["fetched"]+=1
+                        return text
+                    retry_after=response.headers.get("Retry-After")
+                    error=f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError,aiohttp.ClientPayloadError,asyncio.TimeoutError) as e:
+                error=repr(e)
+            if attempt==self.max_retries:
+                break
+            self.stats["retries"]+=1
+            delay=float(retry_after) if retry_after and retry_after.isdigit() else self.backoff*(2**attempt)
+            await asyncio.sleep(delay+random.uniform(0,self.backoff))
+        self.stats["failed"]+=1
+        raise aiohttp.ClientError(f"Failed to fetch {url}: {error}")
+
+    async def listing_links(self, session, base_url):
+        '''Function: To extract the article links of a listing page, rendering it in the browser only if needed'''
+        page_source=await self.fetch(session,base_url,conditional=True)
+        if page_source is None:
+            self.logger.info(f"Listing page not modified since last crawl: {base_url}")
+            return []
+        links=filter_article_links(HTML(html=page_source).links,base_url,self.url_prefix)
+        if len(links)<self.min_static_links and self.browser_pool is not None:
+            #links are loaded by JavaScript, render the page in a pooled browser
+            self.stats["rendered"]+=1
+            page_source=await asyncio.to_thread(self.browser_pool.render,base_url)
+            links=filter_article_links(HTML(html=page_source).links,base_url,self.url_prefix)
+        self.logger.info(f"Successfully extracted {str(len(links))} valid links from {base_url}!")
+        return links
+
+    async def fetch_article(self, session, url):
+        '''Function: To fetch an article in the same format as AsyncHtmlLoader (None if failed)'''
+        try:
+            with metrics.span("scrape"):
+                page_source=await self.fetch(session,url)
+        except aiohttp.ClientError as e:
+            self.logger.error(str(e))
+            return None
+        match=TITLE_PATTERN.search(page_source)
+        title=html.unescape(match.group(1).strip()) if match else ""
+        return Document(page_content=page_source,metadata={"source": url,"title": title})
+
+    def _child_links(self, document, base_urls):
+        '''Function: To extract the article links of a fetched article, to crawl one level deeper'''
+        links=HTML(html=document.page_content).links
+        return [link for base_url in base_urls for link in filter_article_links(links,base_url,self.url_prefix)]
+
+    async def _hand_over(self, session, url, on_document):
+        '''Function: To fetch an article and hand it to on_document, returns the document (None if failed) and whether it was handled'''
+        document=await self.fetch_article(session,url)
+        if document is None:
+            return None,False
+        handled=on_document(document) if on_document is not None else True
+        #a coroutine on_document extracts and saves off the event loop while the other articles are fetched
+        if inspect.isawaitable(handled):
+            handled=await handled
+        return document,bool(handled)
+
+    async def crawl(self, base_urls, depth=0, on_document=None):
+        '''Function: To crawl the listing pages, then hand the new articles level by level up to the given depth to on_document (returning whether it was saved) as each one is fetched, returns the saved count'''
+        connector=aiohttp.TCPConnector(limit=self.max_connections,limit_per_host=self.per_host_connections)
+        timeout=aiohttp.ClientTimeout(total=self.timeout)
+        in_flight={}
+        count=0
+        try:
+            async with aiohttp.ClientSession(connector=connector,timeout=timeout) as session:
+                listings=await asyncio.gather(*(self.listing_links(session,url) for url in base_urls),return_exceptions=True)
+                for base_url,links in zip(base_urls,listings):
+                    if isinstance(links,Exception):
+                        self.logger.error(f"An error occurred in extracting links of {base_url}: {links!r}")
+                        continue
+                    #known articles are filtered out here, before any network fetch
+                    new_links=self.frontier.add(links,0)
+                    self.logger.info(f"{len(new_links)} of {len(links)} article links of {base_url} are new")
+                #pending articles include the ones left over by an interrupted crawl
+                while pending:=deque(self.frontier.pending(depth,self.max_retries)):
+                    while pending or in_flight:
+                        while pending and len(in_flight)<self.max_in_flight:
+                            url,url_depth=pending.popleft()
+                            in_flight[asyncio.ensure_future(self._hand_over(session,url,on_document))]=(url,url_depth)
+                        done,_=await asyncio.wait(in_flight,return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            url,url_depth=in_flight.pop(task)
+                            document,handled=task.result()
+                            if not handled:
+                                #pages failing to download or to extract stay pending until they run out of attempts
+                                self.frontier.mark_failed(url)
+                                continue
+                            #the article is handed over (saved) before being marked as done, so a crash never loses it
+                            self.frontier.mark_done(url,self.frontier.content_hash(document.page_content))
+                            count+=1
+                            if url_depth<depth:
+                                self.frontier.add(self._child_links(document,base_urls),url_depth+1)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            self._save_validators(base_urls)
+            self.logger.info(f"Crawl stats: {self.stats}, frontier: {self.frontier.stats()}")
+        return count
+
+    def run(self, base_urls, depth=0, on_document=None):
+        '''Function: To run the crawl from synchronous code'''
+        try:
+            return asyncio.run(self.crawl(base_urls,depth,on_document))
+        finally:
+            if self.browser_pool is not None:
+                self.browser_pool.close()
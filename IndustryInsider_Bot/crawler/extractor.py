@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lxml.html
+from lxml import etree
+
+from instrumentation.telemetry import metrics
+
+#inline code and no-script fallbacks are not article text, BeautifulSoup's text skipped scripts and styles too
+NON_TEXT_TAGS=("script","style","noscript")
+
+def class_xpath(class_name, axis="//"):
+    '''Function: To build the xpath matching a div the same way BeautifulSoup's class_ argument does, axis ".//" searches below the context element only'''
+    if " " in class_name:
+        #a multi valued class string only matches the exact attribute value
+        return f"{axis}div[@class='{class_name}']"
+    return f"{axis}div[contains(concat(' ',normalize-space(@class),' '),' {class_name} ')]"
+
+
+@lru_cache(maxsize=None)
+def compiled_selectors(extract_class, exclude_classes):
+    '''Function: To compile the class selectors once per process'''
+    #the excluded divs are looked up inside the article, as BeautifulSoup's find on the article did
+    return etree.XPath(class_xpath(extract_class)),[etree.XPath(class_xpath(name,".//")) for name in exclude_classes]
+
+
+def extract_page(page_content, title, extract_class, exclude_classes):
+    '''Function: To extract the article text from raw html, None if the page has no article content'''
+    extract_selector,exclude_selectors=compiled_selectors(extract_class,tuple(exclude_classes))
+    tree=lxml.html.fromstring(page_content)
+    #Extract only relevant Html data
+    matches=extract_selector(tree)
+    if not matches:
+        return None
+    relevant_html=matches[0]
+    #Remove unnecessary elements from the relevant html data
+    for exclude_selector in exclude_selectors:
+        elements=exclude_selector(relevant_html)
+        if elements:
+            elements[0].drop_tree()
+    #the text after an inline script still belongs to the article
+    etree.strip_elements(relevant_html,*NON_TEXT_TAGS,with_tail=False)
+    #Concatenate the title with it's content
+    title=str(title).removesuffix(' - The Economic Times')
+    return title,"\n\n".join([title,relevant_html.text_content()])
+
+
+def extract_batch(pages, extract_class, exclude_classes):
+    '''Function: To extract a batch of pages, isolating the failure of every page'''
+    results=[]
+    for source,page_content,title in pages:
+        start=time.perf_counter()
+        try:
+            extracted=extract_page(page_content,title,extract_class,exclude_classes)
+            error=None if extracted is not None else "no article content found"
+        except Exception as e:
+            extracted,error=None,repr(e)
+        #parse time is measured in the worker and recorded by the parent process
+        results.append((source,extracted,error,time.perf_counter()-start))
+    return results
+
+
+class ArticleExtractor():
+    '''Class to extract article text from raw html on a process pool, streaming results as pages are parsed'''
+    def __init__(self, extract_class, exclude_classes, logger=None, max_workers=None, batch_size=16, min_parallel_pages=64):
+        '''Constructor for initialization'''
+        self.logger=logger or logging.getLogger(__name__)
+        self.extract_class=extract_class
+        self.exclude_classes=tuple(exclude_classes)
+        self.max_workers=max_workers or os.cpu_count()
+        self.batch_size=batch_size
+        #below this number of pages the pool start up costs more than it saves
+        self.min_parallel_pages=min_parallel_pages
+        self.failed=0
+        #started on first use and kept for the lifetime of the extractor, the crawler submits pages one by one
+        self._executor=None
+
+    @classmethod
+    def from_env(cls, extract_class, exclude_classes, logger=None):
+        '''Function: To create the extractor using the worker settings from the environment'''
+        max_workers=int(os.environ.get("EXTRACT_WORKERS","0")) or None
+        return cls(extract_class,exclude_classes,logger,max_workers=max_workers,
+                   batch_size=int(os.environ.get("EXTRACT_BATCH_SIZE","16")))
+
+    def _pool(self):
+        '''Function: To return the process pool, started on first use'''
+        if self._executor is None:
+            self._executor=ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _results(self, pages):
+        '''Function: To yield the per page results, from the process pool when worth it'''
+        if len(pages)<self.min_parallel_pages or self.max_workers<=1:
+            yield from extract_batch(pages,self.extract_class,self.exclude_classes)
+            return
+        futures=[self._pool().submit(extract_batch,pages[start:start+self.batch_size],self.extract_class,self.exclude_classes)
+                 for start in range(0,len(pages),self.batch_size)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+    def _record(self, source, extracted, error, seconds):
+        '''Function: To record the parse time and failure of a page, returns the extracted (title, article content) or None'''
+        metrics.observe("parse",seconds)
+        if error is not None:
+            self.failed+=1
+            metrics.increment("parse_errors")
+            self.logger.error(f"Failed to extract the article {source}: {error}")
+            return None
+        return extracted
+
+    def extract(self, html_data):
+        '''Function: To yield (title, article content) for every page as soon as it is parsed'''
+        for _,title,articlecontent in self.extract_with_sources(html_data):
+            yield title,articlecontent
+
+    def extract_with_sources(self, html_data):
+        '''Function: To yield (source, title, article content) for every page extracted successfully'''
+        pages=[(raw_html.metadata.get('source'),raw_html.page_content,raw_html.metadata.get('title',''))
+               for raw_html in html_data]
+        for source,extracted,error,seconds in self._results(pages):
+            extracted=self._record(source,extracted,error,seconds)
+            if extracted is not None:
+                yield (source,)+extracted
+
+    async def extract_async(self, raw_html):
+        '''Function: To extract one page on the process pool without blocking the event loop, returns (title, article content) or None'''
+        page=(raw_html.metadata.get('source'),raw_html.page_content,raw_html.metadata.get('title',''))
+        #with a single worker the page is parsed on a thread of the loop instead
+        executor=self._pool() if self.max_workers>1 else None
+        [result]=await asyncio.get_running_loop().run_in_executor(executor,extract_batch,[page],self.extract_class,self.exclude_classes)
+        return self._record(*result)
+
+    def close(self):
+        '''Function: To shut down the process pool'''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor=None
@@ -0,0 +1,92 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlparse
+
+ARTICLE_ID_PATTERN=re.compile(r"/articleshow/(\d+)\.cms")
+
+
+def canonical_id(url):
+    '''Function: To return the canonical ID of an article, the numeric articleshow id when there is one'''
+    match=ARTICLE_ID_PATTERN.search(url)
+    if match:
+        return match.group(1)
+    parsed=urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+class CrawlFrontier():
+    '''Class to keep the crawl frontier and the seen-URL index on disk so crawls skip known articles and can resume'''
+    def __init__(self, frontier_path):
+        '''Constructor for initialization'''
+        frontier_dir=os.path.dirname(os.path.abspath(frontier_path))
+        if not os.path.exists(frontier_dir):
+            os.makedirs(frontier_dir)
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(frontier_path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles(
+                canonical_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                discovered_at REAL NOT NULL,
+                fetched_at REAL,
+                content_hash TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS idx_articles_state ON articles(state, depth);
+        """)
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        '''Function: To open the crawl frontier configured in the environment'''
+        return cls(os.environ.get("CRAWL_FRONTIER_PATH","./cache/crawl_frontier.sqlite3"))
+
+    @staticmethod
+    def content_hash(text):
+        '''Function: To compute the content hash of a fetched page'''
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def add(self, urls, depth):
+        '''Function: To enqueue the urls never seen before and return only those'''
+        now=time.time()
+        new_urls=[]
+        with self._lock:
+            for url in dict.fromkeys(urls):
+                cursor=self._conn.execute(
+                    "INSERT OR IGNORE INTO articles(canonical_id,url,depth,state,discovered_at) VALUES(?,?,?,'pending',?)",
+                    (canonical_id(url),url,depth,now))
+                if cursor.rowcount:
+                    new_urls.append(url)
+            self._conn.commit()
+        return new_urls
+
+    def pending(self, max_depth, max_attempts=3):
+        '''Function: To return the pending urls (including the ones left over by an interrupted crawl) as (url, depth)'''
+        with self._lock:
+            return self._conn.execute(
+                "SELECT url, depth FROM articles WHERE state='pending' AND depth<=? AND attempts<? ORDER BY depth, discovered_at",
+                (max_depth,max_attempts)).fetchall()
+
+    def mark_done(self, url, content_hash):
+        '''Function: To record an article as fetched and saved'''
+        with self._lock:
+            self._conn.execute("UPDATE articles SET state='done', fetched_at=?, content_hash=COALESCE(?,content_hash), attempts=attempts+1 WHERE canonical_id=?",
+                               (time.time(),content_hash,canonical_id(url)))
+            self._conn.commit()
+
+    def mark_failed(self, url):
+        '''Function: To count a failed attempt, the article stays pending until it runs out of attempts'''
+        with self._lock:
+            self._conn.execute("UPDATE articles SET attempts=attempts+1 WHERE canonical_id=?",(canonical_id(url),))
+            self._conn.commit()
+
+    def stats(self):
+        '''Function: To count the articles per state'''
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM articles GROUP BY state").fetchall())
@@ -1,14 +1,14 @@
 import os 
-import time
+import asyncio
 import traceback
-import logging
-import glob
-from datetime import datetime
-from urllib.parse import urljoin, urlparse 
 from requests_html import HTML
-from bs4 import BeautifulSoup 
 from selenium import webdriver 
 from langchain_community.document_loaders import AsyncHtmlLoader
+from crawler.async_crawler import AsyncCrawler, filter_article_links, render_page
+from crawler.frontier import CrawlFrontier
+from crawler.extractor import ArticleExtractor
+from ingestion.dedup import NearDuplicateIndex
+from instrumentation.telemetry import setup
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
@@ -17,44 +17,22 @@ class WebScrap():
     def __init__(self,output_dirname, extract_class, exclude_classes, url_prefix):
         '''Default Initialiation'''
         #Log file creation
-        self.logger=self._log_file_creation()
+        self.logger=setup("DataExtraction","Data_extraction")
         #Variable initialization
         self.extract_class=extract_class 
         self.exclude_classes=exclude_classes 
         self.url_prefix=url_prefix
         self.output_dir=output_dirname
+        #Seen-URL index so known articles are skipped before download and crawls can resume
+        self.frontier=CrawlFrontier.from_env()
+        #Extraction stage with a fast parser and precompiled class selectors
+        self.extractor=ArticleExtractor.from_env(extract_class,exclude_classes,self.logger)
+        #MinHash signatures of the stored articles, shared with Data_loading
+        self.dedup=NearDuplicateIndex.from_env()
         #Directory creation for storing articles
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def _log_file_creation(self):
-        '''Function to create log file and logger object'''
-        log_dir=os.path.join(os.environ["LOG_DIR"],"DataExtraction")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        list_of_log_files= glob.glob(f"{log_dir}/*.log")
-        if list_of_log_files:
-            latest_log_file=max(list_of_log_files,key=os.path.getctime)
-            if os.stat(latest_log_file).st_size >= int(os.environ["LOG_FILE_SIZE"]):
-                logfilepath=os.path.join(log_dir,str(datetime.now().strftime('Data_extraction_%Y%m%d%S.log')))
-            else:
-                logfilepath=latest_log_file
-
-        else:
-            logfilepath=os.path.join(log_dir,str(datetime.now().strftime('Data_extraction_%Y%m%d%S.log')))
-        #Configure logging to write to a file in the log directory
-        fileh=logging.FileHandler(logfilepath,'a')
-        formatter=logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fileh.setFormatter(formatter)
-        logger=logging.getLogger()
-        logger.setLevel(logging.INFO)
-        #remove all old handler
-        for hdlr in logger.handlers[:]:
-            logger.removeHandler(hdlr)
-        #set new handler
-        logger.addHandler(fileh)
-        return logger
-
     def html_loader(self,url):
         '''Function to load the raw html content of webpage'''
         loader = AsyncHtmlLoader(url)
@@ -62,58 +40,41 @@ class WebScrap():
         self.logger.info("Successfully loaded the html content!")
         return docs
 
-    def remove_element(self,html_data):
-        '''Function to remove unwanted elements from html data '''
-        for class_name in self.exclude_classes:
-            ele=html_data.find('div',class_=class_name)
-            if ele:
-                ele.extract()
-
     def extract_text(self,html_data): 
-        '''Function to extract and save the relevant data from raw html'''
-        for raw_html in html_data:
-            soup=BeautifulSoup(raw_html.page_content, "html.parser")
-            #Extract only relevant Html data
-            relevant_html=soup.find('div',class_=self.extract_class)
-            #Remove unnecessary elements from the relevant html data 
-            self.remove_element(relevant_html)
-            #Concatenate the title with it's content 
-            title=str(raw_html.metadata['title']).removesuffix(' - The Economic Times') 
-            articlecontent="\n\n".join([title,relevant_html.text])
+        '''Function to extract and save the relevant data from raw html, returns the sources of the extracted pages'''
+        extracted=[]
+        #pages are parsed on a process pool, every article is stored as soon as it is parsed
+        for source,title,articlecontent in self.extractor.extract_with_sources(html_data):
             #Store the article
             self.save_webcontent(title, articlecontent)
+            extracted.append(source)
+        return extracted
+
+    async def extract_and_save(self,raw_html):
+        '''Function to extract a fetched page on the process pool and save it off the event loop, returns whether it was saved'''
+        extracted=await self.extractor.extract_async(raw_html)
+        if extracted is None:
+            return False
+        title,articlecontent=extracted
+        #the file write and the dedup transaction run on a thread, the crawler keeps fetching meanwhile
+        await asyncio.to_thread(self.save_webcontent,title,articlecontent)
+        return True
 
     def articlelink_extractor(self,url):
         '''Function to extract all the article links from base url'''
         driver=webdriver.Chrome()
         driver.maximize_window()
-        driver.get(url)
-        #Sleep cause need time to redirect to the main page and load 
-        time.sleep(10)
-        screen_height=driver.execute_script("return window.screen.height;")
-        scroll_pause_time=2
-        last_height=0
-        #loop over to scroll the page till the end by the driver 
-        while True:
-            driver.execute_script(f"window.scrollBy(0,3000)")#(screen_height*1});")
-            #pause for specified time before scrolling down 
-            time.sleep(scroll_pause_time) 
-            scroll_height=driver.execute_script("return document.body.scrollHeight")
-            # print(str(scroll_height)+"-"+str(last_height))
-            #when reached the end stop scrolling 
-            if scroll_height==last_height:
-                break
-            last_height=scroll_height
-        #After loading the page entirely, we can fetch raw data 
-        page_source=driver.page_source
+        try:
+            #Load the page and scroll till the end, waiting on the DOM readiness instead of fixed sleeps
+            page_source=render_page(driver,url)
+        finally:
+            driver.quit()
         #converting raw data in to HTML 
         html_data=HTML(html=page_source)
         #Extrating only links from html 
         all_links=html_data.links
-        #convert all the links into absolute links
-        abolsute_links=[urljoin(self.url_prefix,link) for link in all_links]
-        #Filter only the valid links
-        valid_sublinks=[link for link in abolsute_links if link.startswith((url)) and (urlparse(link).path.split('/')[-2] == "articleshow")] 
+        #convert all the links into absolute links and filter only the valid links
+        valid_sublinks=filter_article_links(all_links,url,self.url_prefix)
         self.logger.info(f"Successfully extracted {str(len(valid_sublinks))} valid links!")
         return valid_sublinks
     
@@ -123,6 +84,11 @@ class WebScrap():
         content_file=os.path.join(self.output_dir,article_filename+'.md')
         #Do not store duplicate articles
         if not os.path.exists(content_file):
+            #the same story is republished under other titles, near-duplicates of stored articles are dropped
+            duplicate=self.dedup.check_and_add("article",article_filename+'.md',text)
+            if duplicate:
+                self.logger.info(f"Skipped the file: {article_filename}, near-duplicate of {duplicate[0]} (similarity {duplicate[1]:.2f})")
+                return
             with open(content_file, 'w' ,encoding='utf-8') as f:
                 f.write(text)
         self.logger.info(f"Successfully saved the file: {article_filename}")
@@ -132,18 +98,48 @@ class WebScrap():
         # Get list of all the article's link 
         article_links=self.articlelink_extractor(url)
         # print('Total -number of article links:', len(article_links))
-        article_html=self.html_loader(article_links)
-        # print('Total number of article in html format:', len(article_html))
-        self.extract_text(article_html)
+        #Only the articles never seen before are queued for download
+        self.frontier.add(article_links,0)
+        for level in range(depth+1):
+            pending_links=[link for link,link_depth in self.frontier.pending(depth) if link_depth==level]
+            if not pending_links:
+                continue
+            article_html=self.html_loader(pending_links)
+            # print('Total number of article in html format:', len(article_html))
+            extracted=set(self.extract_text(article_html))
+            for raw_html in article_html:
+                if raw_html.metadata['source'] not in extracted:
+                    #failed or empty pages stay pending until they run out of attempts, as in the async crawler
+                    self.frontier.mark_failed(raw_html.metadata['source'])
+                    continue
+                self.frontier.mark_done(raw_html.metadata['source'],CrawlFrontier.content_hash(raw_html.page_content))
+                #follow the article links of children urls till the given depth
+                if level<depth:
+                    child_links=filter_article_links(HTML(html=raw_html.page_content).links,url,self.url_prefix)
+                    self.frontier.add(child_links,level+1)
+
+    def async_webcontentextractor(self, base_urls, depth=0):
+        '''Function to crawl listing pages and articles concurrently, using the browser only when needed'''
+        crawler=AsyncCrawler.from_env(self.url_prefix,self.logger,self.frontier)
+        #every article is extracted and saved as soon as it is fetched, at most max_in_flight pages are held at once
+        #pages without article content are marked as failed and retried instead of done
+        crawler.run(base_urls,depth,on_document=self.extract_and_save)
 
     def main(self,base_urls):
         '''Main function'''
         try:
-            for base_url in base_urls:
-                self.webcontentextractor(base_url,depth=0)
+            depth=int(os.environ.get("CRAWL_DEPTH","0"))
+            if os.environ.get("CRAWLER_MODE","async")=="async":
+                self.async_webcontentextractor(base_urls,depth)
+            else:
+                for base_url in base_urls:
+                    self.webcontentextractor(base_url,depth=depth)
+            self.logger.info(f"Dedup ratios: {self.dedup.stats()}")
         except Exception as e:
             stack_trc=traceback.format_exc()
             self.logger.error(f"An error occurred in extracting articles: {str(stack_trc)}")
+        finally:
+            self.extractor.close()
     
 '''Initializing the inputs'''
 #class element to extract article links
@@ -155,7 +151,9 @@ url_prefix="https://economictimes.indiatimes.com/"
 base_urls=["https://economictimes.indiatimes.com/industry/indl-goods/svs/engineering"] 
 #directory to save extracted articles
 output_dirname='./data/Articles'
-#creating class object 
-obj=WebScrap(output_dirname, extract_class,exclude_classes, url_prefix)
-#calling class function 
-obj.main(base_urls)
+#guarded so the extraction worker processes can import this module without starting a crawl
+if __name__=="__main__":
+    #creating class object 
+    obj=WebScrap(output_dirname, extract_class,exclude_classes, url_prefix)
+    #calling class function 
+    obj.main(base_urls)
@@ -1,15 +1,20 @@
 import os 
-import logging
 import traceback
-import glob
 from pathlib import Path
-from datetime import datetime
 
 import tiktoken
-from langchain_experimental.text_splitter import SemanticChunker
 from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
 from langchain_community.vectorstores import Chroma
 
+from ingestion.manifest import IngestionManifest
+from ingestion.pipeline import IngestionPipeline
+from ingestion.chunker import SinglePassSemanticChunker
+from ingestion.dedup import NearDuplicateIndex
+from caching.embedding_cache import CachedEmbeddings
+from retrieval.keyword_index import KeywordIndex
+from retrieval.vector_index import export_from_env
+from instrumentation.telemetry import setup
+
 from dotenv import load_dotenv 
 load_dotenv(override=True)
 
@@ -17,92 +22,145 @@ class Data_loading():
     '''Class to Perform Data loading based in the given document in Vector DB'''
     def __init__(self):
         '''Constructor for initialization'''
-        self.logger=self._log_file_creation()
+        self.logger=setup("Vector","Vector_store")
         token_encodingname=os.environ["TIKTOKEN_MODEL"]
         self.max_tokens=int(os.environ["MAX_CHUNK_TOKENS"])
-        self.chunks_list=[]
         self.data_folder=os.environ["Data_dir"]
         self.file_extension=os.environ["FILE_EXTENSION"]
-        self.EMBEDDINGS=HuggingFaceInferenceAPIEmbeddings(
+        #Embeddings are cached on disk so re-runs and recursive splits never embed the same text twice
+        self.EMBEDDINGS=CachedEmbeddings.from_env(HuggingFaceInferenceAPIEmbeddings(
             api_key=os.environ["HUGGINGFACEHUB_API_TOKEN"],
             model_name=os.environ["EMBEDDING_MODEL"]
-        )
+        ))
         self.encoding=tiktoken.get_encoding(token_encodingname)
-        self.text_splitter=SemanticChunker(self.EMBEDDINGS, breakpoint_threshold_type="percentile")
-
-    def _log_file_creation(self):
-        '''Function to create log file and logger object'''
-        log_dir=os.path.join(os.environ["LOG_DIR"],"Vector")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        list_of_log_files= glob.glob(f"Vector/{log_dir}/*.log")
-        if list_of_log_files:
-            latest_log_file=max(list_of_log_files,key=os.path.getctime)
-            if os.stat(latest_log_file).st_size >= int(os.environ["LOG_FILE_SIZE"]):
-                logfilepath=os.path.join(log_dir,str(datetime.now().strftime('Vector_store_%Y%m%d%S.log')))
-            else:
-                logfilepath=latest_log_file
-        else:
-            logfilepath=os.path.join(log_dir,str(datetime.now().strftime('Vector_store_%Y%m%d%S.log')))
-        #Configure logging to write to a file in the log directory
-        fileh=logging.FileHandler(logfilepath,'a')
-        formatter=logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fileh.setFormatter(formatter)
-        logger=logging.getLogger()
-        logger.setLevel(logging.INFO)
-        #remove all old handler
-        for hdlr in logger.handlers[:]:
-            logger.removeHandler(hdlr)
-        #set new handler
-        logger.addHandler(fileh)
-        return logger
+        #Sentences are embedded once per article, oversized chunks are split again on the same distances
+        self.text_splitter=SinglePassSemanticChunker.from_env(self.EMBEDDINGS,self.encoding)
+        self.vector_path=os.environ["VECTOR_PATH"]
+        #Manifest of already ingested articles, kept next to the vector db
+        self.manifest=IngestionManifest(IngestionManifest.default_path())
+        self.vector_db=Chroma(persist_directory=self.vector_path,embedding_function=self.EMBEDDINGS)
+        #BM25 index persisted next to the vector db and kept in sync with it
+        self.keyword_index=KeywordIndex.from_env()
+        #MinHash signatures of the ingested articles and chunks, shared with WebScrap
+        self.dedup=NearDuplicateIndex.from_env()
 
-    def store_vectordb(self, documents) :
-        '''Function: To store the generated embeddings into vector db'''
-        self.logger.info("Creating vector store...")
-        vectorstore=Chroma.from_documents(documents, self.EMBEDDINGS,persist_directory=os.environ["VECTOR_PATH"]) 
+    def store_vectordb(self, documents, ids, embeddings=None):
+        '''Function: To upsert the generated embeddings into vector db using deterministic IDs'''
+        self.logger.info(f"Upserting {str(len(documents))} chunks into vector store...")
+        if documents and embeddings is None:
+            self.vector_db.add_documents(documents, ids=ids)
+        elif documents:
+            #embeddings were already computed by the pipeline, write them as they are
+            self.vector_db._collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=[document.page_content for document in documents],
+                metadatas=[document.metadata for document in documents],
+            )
+        if documents:
+            self.keyword_index.add_documents(ids,documents)
         self.logger.info("Successfully stored the data into VectorDB!")
 
-    def split_chunks(self, chunk):
-        """Function: To recursively create sub chunks from parent chunk""" 
-        text=chunk.page_content
-        token_count=len(self.encoding.encode(text))
-        # print (token_count)
-        if token_count <= self.max_tokens:
-            self.chunks_list.append(chunk)
-        else:
-            all_subsplits=self.text_splitter.create_documents([text]) 
-            
-            for subsplit in all_subsplits: 
-                self.split_chunks(subsplit)
+    def delete_vectordb(self, ids):
+        '''Function: To remove chunks of changed or deleted articles from vector db'''
+        if ids:
+            self.vector_db.delete(ids=list(ids))
+            self.keyword_index.delete(list(ids))
+            self.logger.info(f"Removed {str(len(ids))} stale chunks from vector store")
+
+    def purge_unmanaged(self, batch_size=1000):
+        '''Function: To delete the chunks of vector db which no manifest entry produced, e.g. written before the manifest existed'''
+        unmanaged,offset=[],0
+        while True:
+            ids=self.vector_db.get(limit=batch_size,offset=offset,include=[])["ids"]
+            if not ids:
+                break
+            unmanaged.extend(doc_id for doc_id in ids if not self.manifest.has_chunk(doc_id))
+            offset+=len(ids)
+        for start in range(0,len(unmanaged),batch_size):
+            batch=unmanaged[start:start+batch_size]
+            self.delete_vectordb(batch)
+            self.dedup.remove_keys("chunk",batch)
+        return len(unmanaged)
+
+    def read_article(self, filename):
+        '''Function: To read an article of the data folder'''
+        with open(os.path.join(self.data_folder,filename),'r',encoding="utf-8") as file:
+            return file.read()
+
+    def scan_articles(self):
+        '''Function: To compute the content hash of every article in the data folder'''
+        current_hashes={}
+        for filename in os.listdir(self.data_folder):
+            if filename.endswith(self.file_extension):
+                with open(os.path.join(self.data_folder,filename),'r',encoding="utf-8") as file:
+                    current_hashes[filename]=IngestionManifest.content_hash(file.read())
+        return current_hashes
+
+    def chunk_article(self, filename, md_content):
+        '''Function: To chunk a single article and attach its source and deterministic chunk IDs'''
+        #semantic split and MAX_CHUNK_TOKENS check in a single pass
+        chunks=self.text_splitter.create_documents([md_content])
+        ids=[]
+        for index,chunk in enumerate(chunks):
+            chunk.metadata["source"]=filename
+            chunk.metadata["chunk_index"]=index
+            ids.append(IngestionManifest.chunk_id(filename,index))
+        return chunks,ids
 
-    def validatetokenlength(self,data):
-        '''Funtion: To split the chunk further based on number of chunks if the chunk is falling under above criteria'''
-        for i in range(len(data)):
-            self.split_chunks(data[i])
-        return self.chunks_list
-    
     def data_chunking(self):
-        '''Function: perfroms the chunking of document using semantic splitter'''
-        merged_splits=[]
-        for filename in os.listdir(self.data_folder): 
+        '''Function: perfroms the chunking of document using semantic splitter, one article at a time'''
+        for filename in os.listdir(self.data_folder):
             if filename.endswith(self.file_extension):
                 with open(os.path.join(self.data_folder,filename),'r',encoding="utf-8") as file:
                     md_content =file.read()
-                all_splits=self.text_splitter.create_documents([md_content])
-                merged_splits.extend(all_splits)
-        chunks=self.validatetokenlength(merged_splits)
-        self.logger.info(f"total Number of chunks: {str(len(chunks))}")
-        return chunks
+                chunks,_=self.chunk_article(filename,md_content)
+                yield from chunks
+
+    def incremental_ingest(self):
+        '''Function: Ingests only new or changed articles and removes deleted ones from the vector db'''
+        if self.manifest.count()==0 and self.vector_db._collection.count()>0:
+            #legacy chunks would stay next to their re-ingested copies and seed the keyword and dedup indexes
+            self.logger.info(f"Removed {self.purge_unmanaged()} chunks not recorded in the manifest")
+        if self.keyword_index.count()==0 and self.vector_db._collection.count()>0:
+            self.logger.info(f"Built keyword index from {self.keyword_index.rebuild_from_vectordb(self.vector_db)} stored chunks")
+        current_hashes=self.scan_articles()
+        new,changed,unchanged,deleted=self.manifest.diff(current_hashes)
+        self.logger.info(f"Articles new: {len(new)}, changed: {len(changed)}, unchanged: {len(unchanged)}, deleted: {len(deleted)}")
+        if self.dedup.count("chunk")==0 and self.vector_db._collection.count()>0:
+            #articles ingested before the dedup stage existed are what new articles are compared with
+            self.dedup.add("article",[(filename,self.read_article(filename),None) for filename in unchanged])
+            self.logger.info(f"Built dedup index from {len(unchanged)} articles and {self.dedup.rebuild_from_vectordb(self.vector_db)} stored chunks")
+        #articles with texts dropped as duplicates of a changed or deleted article are ingested again to restore them
+        rechecked=[filename for filename in self.manifest.dependents(changed+deleted) if filename in current_hashes and filename not in changed]
+        if rechecked:
+            self.logger.info(f"Re-ingesting {len(rechecked)} articles which repeated changed or deleted articles")
+        for filename in changed+deleted+rechecked:
+            #forgotten up front, so the texts which repeated them are kept whatever order the pipeline runs in
+            self.dedup.remove_source("article",filename)
+            self.dedup.remove_source("chunk",filename)
+        for filename in deleted:
+            self.delete_vectordb(self.manifest.chunk_ids_for(filename))
+            self.manifest.remove(filename)
+        #read -> dedup -> split -> token check -> dedup -> embed -> write, streamed through a bounded worker pool
+        pipeline=IngestionPipeline.from_env(self)
+        pipeline.run(new+changed+rechecked,current_hashes)
+        self.logger.info(f"Ingestion completed, manifest version: {self.manifest.version}")
+        self.logger.info(f"Dedup ratios: {self.dedup.stats()}")
+        if os.environ.get("VECTOR_STORE","chroma")=="mmap" and (new or changed or deleted):
+            #serving processes switch over to the new build on their next query
+            export_from_env(self.manifest.version).close()
+        self.logger.info(f"Embedding cache stats: {self.EMBEDDINGS.stats()}")
+        return new,changed,deleted
 
     def main(self):
         '''Function: Does the data loading from creating chunks to embedding then storing in the vector'''
         try:
-            chunks=self.data_chunking()
-            # self.store_vectordb(chunks)
+            self.incremental_ingest()
         except Exception as e:
             stack_trc=traceback.format_exc()
             self.logger.error(f"An error occurred in extracting articles: {str(stack_trc)}")
 
-obj=Data_loading() 
-chunks=obj.main()
+if __name__=="__main__":
+    obj=Data_loading() 
+    chunks=obj.main()
@@ -0,0 +1,86 @@
+import os
+import re
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class SinglePassSemanticChunker():
+    '''Class to split text at semantic breakpoints embedding every sentence once, keeping the chunks within max_tokens'''
+    def __init__(self, embeddings, encoding, max_tokens, buffer_size=1, breakpoint_percentile=95, sentence_split_regex=r"(?<=[.?!])\s+"):
+        '''Constructor for initialization'''
+        self.embeddings=embeddings
+        self.encoding=encoding
+        self.max_tokens=max_tokens
+        #sentences on either side embedded along with a sentence, as SemanticChunker does
+        self.buffer_size=buffer_size
+        self.breakpoint_percentile=breakpoint_percentile
+        self.sentence_pattern=re.compile(sentence_split_regex)
+
+    @classmethod
+    def from_env(cls, embeddings, encoding):
+        '''Function: To create the chunker using the chunk settings from the environment'''
+        return cls(embeddings,encoding,int(os.environ["MAX_CHUNK_TOKENS"]),
+                   breakpoint_percentile=float(os.environ.get("CHUNK_BREAKPOINT_PERCENTILE","95")))
+
+    def sentence_distances(self, sentences):
+        '''Function: To embed every sentence with its neighbours in one call and return the cosine distance to the next one'''
+        combined=[" ".join(sentences[max(index-self.buffer_size,0):index+1+self.buffer_size]) for index in range(len(sentences))]
+        vectors=np.asarray(self.embeddings.embed_documents(combined),dtype=np.float32)
+        norms=np.linalg.norm(vectors,axis=1)
+        norms[norms==0]=1.0
+        vectors/=norms[:,None]
+        return 1.0-np.einsum("ij,ij->i",vectors[:-1],vectors[1:])
+
+    def token_counts(self, sentences):
+        '''Function: To count the tokens of every sentence, alone and following another sentence of its chunk'''
+        alone=np.array([len(tokens) for tokens in self.encoding.encode_ordinary_batch(sentences)],dtype=np.int64)
+        joined=np.array([len(tokens) for tokens in self.encoding.encode_ordinary_batch([" "+sentence for sentence in sentences])],dtype=np.int64)
+        return alone,joined
+
+    def segments(self, distances, alone, joined):
+        '''Function: To split the sentences at breakpoints and split oversized segments again on their own distances, as (start, end)'''
+        prefix=np.concatenate([[0],np.cumsum(joined)])
+        segments=[]
+        #(start, end, top level), the top level is always split once like SemanticChunker does
+        pending=[(0,len(alone),True)]
+        while pending:
+            start,end,top=pending.pop()
+            tokens=alone[start]+prefix[end]-prefix[start+1]
+            gaps=distances[start:end-1]
+            if len(gaps)==0 or (not top and tokens<=self.max_tokens):
+                segments.append((start,end))
+                continue
+            #breakpoints of an oversized segment come from its own distance distribution, no new embeddings needed
+            cuts=np.nonzero(gaps>np.percentile(gaps,self.breakpoint_percentile))[0]
+            if len(cuts)==0 and not top:
+                #evenly spread distances still have to shrink the segment
+                cuts=[int(np.argmax(gaps))]
+            bounds=[start]+[start+int(cut)+1 for cut in cuts]+[end]
+            pending.extend(reversed([(left,right,False) for left,right in zip(bounds[:-1],bounds[1:])]))
+        return segments
+
+    def split_text(self, text) -> List[str]:
+        '''Function: To split a text into semantically coherent chunks of at most max_tokens'''
+        sentences=self.sentence_pattern.split(text)
+        if len(sentences)==1:
+            return self._fit(text)
+        alone,joined=self.token_counts(sentences)
+        chunks=[]
+        for start,end in self.segments(self.sentence_distances(sentences),alone,joined):
+            chunk=" ".join(sentences[start:end])
+            chunks.extend(self._fit(chunk) if end-start==1 else [chunk])
+        return chunks
+
+    def _fit(self, sentence):
+        '''Function: To cut a single sentence longer than max_tokens into token windows'''
+        tokens=self.encoding.encode_ordinary(sentence)
+        if len(tokens)<=self.max_tokens:
+            return [sentence]
+        return [self.encoding.decode(tokens[start:start+self.max_tokens]) for start in range(0,len(tokens),self.max_tokens)]
+
+    def create_documents(self, texts, metadatas=None) -> List[Document]:
+        '''Function: To split the texts into chunk documents, the interface of the langchain text splitters'''
+        metadatas=metadatas or [{}]*len(texts)
+        return [Document(page_content=chunk,metadata=dict(metadata)) for text,metadata in zip(texts,metadatas) for chunk in self.split_text(text)]
@@ -0,0 +1,177 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+from instrumentation.telemetry import metrics
+
+WORD_PATTERN=re.compile(r"\w+")
+#smallest prime above 2**32, (a*x+b) with a and x below 2**32 never overflows 64 bits
+HASH_PRIME=np.uint64(4294967311)
+
+
+class NearDuplicateIndex():
+    '''Class to detect near-duplicate articles and chunks with MinHash/LSH, keeping the signatures on disk'''
+    def __init__(self, index_path, num_perm=128, bands=16, threshold=0.8, shingle_size=3, seed=1):
+        '''Constructor for initialization'''
+        if num_perm%bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        index_dir=os.path.dirname(os.path.abspath(index_path))
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self.num_perm=num_perm
+        self.bands=bands
+        self.rows=num_perm//bands
+        #estimated Jaccard similarity of the word shingles from which a text counts as duplicate
+        self.threshold=threshold
+        self.shingle_size=shingle_size
+        rng=np.random.default_rng(seed)
+        self._a=rng.integers(1,2**32,num_perm,dtype=np.uint64)[:,None]
+        self._b=rng.integers(0,2**32,num_perm,dtype=np.uint64)[:,None]
+        #kind -> [checked, duplicates] of this process
+        self.counts={}
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(index_path,check_same_thread=False,timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signatures(
+                kind TEXT NOT NULL,
+                doc_key TEXT NOT NULL,
+                source TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                added_at REAL NOT NULL,
+                PRIMARY KEY(kind,doc_key)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_signatures_source ON signatures(kind,source);
+            CREATE TABLE IF NOT EXISTS buckets(
+                kind TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                doc_key TEXT NOT NULL,
+                PRIMARY KEY(kind,bucket,doc_key)) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        '''Function: To open the signature index shared by the crawler and the ingestion'''
+        return cls(os.environ.get("DEDUP_INDEX_PATH","./cache/dedup.sqlite3"),
+                   num_perm=int(os.environ.get("DEDUP_NUM_PERM","128")),
+                   bands=int(os.environ.get("DEDUP_BANDS","16")),
+                   threshold=float(os.environ.get("DEDUP_THRESHOLD","0.8")),
+                   shingle_size=int(os.environ.get("DEDUP_SHINGLE_SIZE","3")))
+
+    def signature(self, text):
+        '''Function: To compute the MinHash signature of the word shingles of a text, None when it has no words'''
+        words=WORD_PATTERN.findall(text.lower())
+        if not words:
+            return None
+        size=min(self.shingle_size,len(words))
+        hashes=np.fromiter({zlib.crc32(" ".join(words[index:index+size]).encode("utf-8")) for index in range(len(words)-size+1)},dtype=np.uint64)
+        return ((self._a*hashes+self._b)%HASH_PRIME).min(axis=1).astype(np.uint32)
+
+    def _buckets(self, signature):
+        '''Function: To hash every band of the signature into its LSH bucket'''
+        return [int.from_bytes(hashlib.blake2b(band.to_bytes(2,"little")+signature[band*self.rows:(band+1)*self.rows].tobytes(),digest_size=8).digest(),"little",signed=True)
+                for band in range(self.bands)]
+
+    def _best_match(self, kind, signature, doc_key):
+        '''Function: To return the most similar stored text (doc_key, similarity, source) above the threshold, other than doc_key itself'''
+        buckets=self._buckets(signature)
+        placeholders=','.join('?'*len(buckets))
+        best=None
+        for candidate,stored,source in self._conn.execute(
+                f"SELECT s.doc_key, s.signature, s.source FROM signatures s WHERE s.kind=? AND s.doc_key IN "
+                f"(SELECT doc_key FROM buckets WHERE kind=? AND bucket IN ({placeholders}))",[kind,kind]+buckets):
+            if candidate==doc_key:
+                continue
+            similarity=float(np.mean(np.frombuffer(stored,dtype=np.uint32)==signature))
+            if similarity>=self.threshold and (best is None or similarity>best[1]):
+                best=(candidate,similarity,source)
+        return best
+
+    def _add(self, kind, doc_key, source, signature):
+        '''Function: To store a signature and its buckets without committing'''
+        self._remove_keys(kind,[doc_key])
+        self._conn.execute("INSERT INTO signatures VALUES(?,?,?,?,?)",(kind,doc_key,source,signature.tobytes(),time.time()))
+        self._conn.executemany("INSERT OR IGNORE INTO buckets VALUES(?,?,?)",[(kind,bucket,doc_key) for bucket in self._buckets(signature)])
+
+    def _remove_keys(self, kind, doc_keys):
+        '''Function: To delete signatures and their buckets without committing'''
+        for doc_key in doc_keys:
+            row=self._conn.execute("SELECT signature FROM signatures WHERE kind=? AND doc_key=?",(kind,doc_key)).fetchone()
+            if row is None:
+                continue
+            self._conn.executemany("DELETE FROM buckets WHERE kind=? AND bucket=? AND doc_key=?",
+                                   [(kind,bucket,doc_key) for bucket in self._buckets(np.frombuffer(row[0],dtype=np.uint32))])
+            self._conn.execute("DELETE FROM signatures WHERE kind=? AND doc_key=?",(kind,doc_key))
+
+    def check_and_add(self, kind, doc_key, text, source=None):
+        '''Function: To return the (doc_key, similarity, source) the text duplicates, or store its signature and return None'''
+        signature=self.signature(text)
+        with self._lock:
+            counts=self.counts.setdefault(kind,[0,0])
+            counts[0]+=1
+            metrics.increment(f"dedup_{kind}_checked")
+            if signature is None:
+                return None
+            match=self._best_match(kind,signature,doc_key)
+            if match is not None:
+                counts[1]+=1
+                metrics.increment(f"dedup_{kind}_duplicates")
+                return match
+            #only kept texts are stored, later copies are matched against the original
+            self._add(kind,doc_key,source or doc_key,signature)
+            self._conn.commit()
+        return None
+
+    def add(self, kind, items):
+        '''Function: To store the signatures of (doc_key, text, source) items without checking them'''
+        with self._lock:
+            for doc_key,text,source in items:
+                signature=self.signature(text)
+                if signature is not None:
+                    self._add(kind,doc_key,source or doc_key,signature)
+            self._conn.commit()
+
+    def count(self, kind):
+        '''Function: To return the number of stored signatures of a kind'''
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM signatures WHERE kind=?",(kind,)).fetchone()[0]
+
+    def rebuild_from_vectordb(self, vector_db, batch_size=1000):
+        '''Function: To store the signatures of the chunks already in vector db, batch by batch'''
+        offset=0
+        while True:
+            data=vector_db.get(limit=batch_size,offset=offset,include=["documents","metadatas"])
+            if not data["ids"]:
+                break
+            self.add("chunk",[(doc_id,text,(metadata or {}).get("source",doc_id))
+                              for doc_id,text,metadata in zip(data["ids"],data["documents"],data["metadatas"])])
+            offset+=len(data["ids"])
+        return offset
+
+    def remove_keys(self, kind, doc_keys):
+        '''Function: To forget the signatures of the given texts'''
+        with self._lock:
+            self._remove_keys(kind,doc_keys)
+            self._conn.commit()
+
+    def remove_source(self, kind, source):
+        '''Function: To forget the signatures stored for a source, before it is checked again or after it was deleted'''
+        with self._lock:
+            doc_keys=[row[0] for row in self._conn.execute("SELECT doc_key FROM signatures WHERE kind=? AND source=?",(kind,source))]
+            self._remove_keys(kind,doc_keys)
+            self._conn.commit()
+        return len(doc_keys)
+
+    def stats(self):
+        '''Function: To report the texts checked and dropped as duplicates per kind, with the dedup ratio'''
+        with self._lock:
+            stored=dict(self._conn.execute("SELECT kind, COUNT(*) FROM signatures GROUP BY kind").fetchall())
+            return {kind: {"checked": checked,"duplicates": duplicates,"ratio": duplicates/checked if checked else 0.0,
+                           "stored": stored.get(kind,0)}
+                    for kind,(checked,duplicates) in self.counts.items()}
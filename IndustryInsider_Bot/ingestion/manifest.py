@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+
+
+def _entry_digest(source, content_hash):
+    '''Function: To hash one manifest entry into the 64 bit value folded into the version'''
+    return int.from_bytes(hashlib.sha256(f"{source}:{content_hash}".encode("utf-8")).digest()[:8],"big")
+
+
+class IngestionManifest():
+    '''Class to keep track of ingested articles by file path and content hash, committed article by article'''
+    def __init__(self, manifest_path):
+        '''Constructor for initialization'''
+        self.manifest_path=manifest_path
+        manifest_dir=os.path.dirname(os.path.abspath(manifest_path))
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        self._lock=threading.Lock()
+        self._conn=sqlite3.connect(manifest_path,check_same_thread=False,timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles(
+                source TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                ingested_at TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS chunks(
+                source TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY(source,position)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_chunks_id ON chunks(chunk_id);
+            CREATE TABLE IF NOT EXISTS duplicates(
+                source TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                doc_key TEXT NOT NULL,
+                duplicate_of TEXT NOT NULL,
+                duplicate_source TEXT NOT NULL,
+                PRIMARY KEY(source,kind,doc_key)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_duplicates_source ON duplicates(duplicate_source);
+            CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._conn.commit()
+        self.version=self.read_version(manifest_path)
+
+    @staticmethod
+    def default_path():
+        '''Function: To return the manifest path, kept next to the vector db'''
+        return os.environ.get("INGESTION_MANIFEST",os.path.join(os.environ["VECTOR_PATH"],"ingestion_manifest.sqlite3"))
+
+    @staticmethod
+    def content_hash(text):
+        '''Function: To compute the content hash of an article'''
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def chunk_id(source, index):
+        '''Function: To generate a deterministic chunk ID from the article path and chunk position'''
+        return hashlib.sha1(f"{source}::{index}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def read_version(manifest_path):
+        '''Function: To read only the ingestion version stamp without loading the entries'''
+        if not os.path.exists(manifest_path):
+            return None
+        conn=sqlite3.connect(f"file:{os.path.abspath(manifest_path)}?mode=ro",uri=True,timeout=30)
+        try:
+            row=conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+        except sqlite3.OperationalError:
+            #created but not initialized yet
+            row=None
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    @staticmethod
+    def stamp_paths(manifest_path):
+        '''Function: To return the files whose modification time changes when the manifest is committed'''
+        return (manifest_path,manifest_path+"-wal")
+
+    def _fold(self, digest):
+        '''Function: To add or take out an entry of the version without committing, xor makes it order independent'''
+        current=int(self.version,16) if self.version else 0
+        self.version=f"{current^digest:016x}"
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES('version',?)",(self.version,))
+
+    def _remove(self, source):
+        '''Function: To delete an entry and its chunk IDs without committing'''
+        row=self._conn.execute("SELECT hash FROM articles WHERE source=?",(source,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM chunks WHERE source=?",(source,))
+        self._conn.execute("DELETE FROM duplicates WHERE source=?",(source,))
+        self._conn.execute("DELETE FROM articles WHERE source=?",(source,))
+        self._fold(_entry_digest(source,row[0]))
+
+    def count(self):
+        '''Function: To return the number of ingested articles'''
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def diff(self, current_hashes):
+        '''Function: To compare the current articles (path -> hash) with the manifest'''
+        with self._lock:
+            stored=dict(self._conn.execute("SELECT source, hash FROM articles").fetchall())
+        new,changed,unchanged=[],[],[]
+        for source,content_hash in current_hashes.items():
+            stored_hash=stored.get(source)
+            if stored_hash is None:
+                new.append(source)
+            elif stored_hash!=content_hash:
+                changed.append(source)
+            else:
+                unchanged.append(source)
+        deleted=[source for source in stored if source not in current_hashes]
+        return new,changed,unchanged,deleted
+
+    def chunk_ids_for(self, source):
+        '''Function: To fetch the chunk IDs previously stored for an article'''
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT chunk_id FROM chunks WHERE source=? ORDER BY position",(source,))]
+
+    def has_chunk(self, chunk_id):
+        '''Function: To check whether a chunk ID was produced by an ingested article'''
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chunks WHERE chunk_id=? LIMIT 1",(chunk_id,)).fetchone() is not None
+
+    def dependents(self, sources):
+        '''Function: To find the articles with texts dropped as duplicates of the given articles, or in turn of those articles'''
+        found,pending=set(),list(sources)
+        with self._lock:
+            while pending:
+                for (dependent,) in self._conn.execute("SELECT DISTINCT source FROM duplicates WHERE duplicate_source=?",(pending.pop(),)):
+                    if dependent not in found and dependent not in sources:
+                        found.add(dependent)
+                        pending.append(dependent)
+        return sorted(found)
+
+    def update(self, source, content_hash, chunk_ids, duplicates=()):
+        '''Function: To record an article as ingested with its (kind, doc_key, duplicate_of, duplicate_source) dropped texts, committed right away'''
+        with self._lock:
+            self._remove(source)
+            self._conn.execute("INSERT INTO articles VALUES(?,?,?)",(source,content_hash,datetime.now().isoformat(timespec="seconds")))
+            self._conn.executemany("INSERT INTO chunks VALUES(?,?,?)",[(source,position,chunk_id) for position,chunk_id in enumerate(chunk_ids)])
+            self._conn.executemany("INSERT OR REPLACE INTO duplicates VALUES(?,?,?,?,?)",[(source,)+tuple(duplicate) for duplicate in duplicates])
+            self._fold(_entry_digest(source,content_hash))
+            self._conn.commit()
+
+    def remove(self, source):
+        '''Function: To forget an article which no longer exists'''
+        with self._lock:
+            self._remove(source)
+            self._conn.commit()
+
+    def close(self):
+        '''Function: To close the manifest database'''
+        with self._lock:
+            self._conn.close()
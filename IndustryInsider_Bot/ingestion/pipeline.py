@@ -0,0 +1,134 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation.telemetry import metrics
+
+
+def bounded_map(function, iterable, max_workers, max_in_flight):
+    '''Function: To map items on a worker pool keeping at most max_in_flight items pending, in input order'''
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight=deque()
+        for item in iterable:
+            in_flight.append(executor.submit(function,item))
+            if len(in_flight)>=max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class IngestionPipeline():
+    '''Class to ingest articles as streaming stages: read -> split -> token check -> embed -> write'''
+    def __init__(self, data_loader, max_workers=4, max_in_flight=8, batch_size=64):
+        '''Constructor for initialization'''
+        self.data_loader=data_loader
+        self.logger=data_loader.logger
+        self.max_workers=max_workers
+        self.max_in_flight=max(max_in_flight,max_workers)
+        self.batch_size=batch_size
+        self.written_chunks=0
+
+    @classmethod
+    def from_env(cls, data_loader):
+        '''Function: To create the pipeline using the worker settings from the environment'''
+        return cls(data_loader,
+                   max_workers=int(os.environ.get("INGEST_WORKERS","4")),
+                   max_in_flight=int(os.environ.get("INGEST_MAX_IN_FLIGHT","8")),
+                   batch_size=int(os.environ.get("INGEST_BATCH_SIZE","64")))
+
+    def read_stage(self, filenames):
+        '''Stage: To lazily read the articles, one at a time'''
+        for filename in filenames:
+            with open(os.path.join(self.data_loader.data_folder,filename),'r',encoding="utf-8") as file:
+                yield filename,file.read()
+
+    def article_dedup_stage(self, documents):
+        '''Stage: To drop articles which are near-duplicates of another article before they are chunked'''
+        dedup=self.data_loader.dedup
+        for filename,md_content in documents:
+            duplicates=[]
+            duplicate=dedup.check_and_add("article",filename,md_content)
+            if duplicate:
+                self.logger.info(f"Skipped {filename}, near-duplicate of {duplicate[0]} (similarity {duplicate[1]:.2f})")
+                #still written without chunks, so chunks of an earlier version are removed and the manifest records it
+                md_content=None
+                duplicates.append(("article",filename,duplicate[0],duplicate[2]))
+            yield filename,md_content,duplicates
+
+    def chunk_stage(self, documents):
+        '''Stage: To semantically split and token-check the documents on the worker pool'''
+        def chunk_document(document):
+            filename,md_content,duplicates=document
+            if md_content is None:
+                return filename,[],[],duplicates
+            with metrics.span("chunk"):
+                chunks,ids=self.data_loader.chunk_article(filename,md_content)
+            return filename,chunks,ids,duplicates
+        yield from bounded_map(chunk_document,documents,self.max_workers,self.max_in_flight)
+
+    def chunk_dedup_stage(self, chunked_documents):
+        '''Stage: To drop chunks repeating an already ingested chunk before they are embedded'''
+        dedup=self.data_loader.dedup
+        for filename,chunks,ids,duplicates in chunked_documents:
+            #chunks of an earlier version of the article must not match the new ones
+            dedup.remove_source("chunk",filename)
+            kept=[]
+            for chunk,chunk_id in zip(chunks,ids):
+                duplicate=dedup.check_and_add("chunk",chunk_id,chunk.page_content,source=filename)
+                if duplicate is None:
+                    kept.append((chunk,chunk_id))
+                else:
+                    #recorded so the chunk is restored once the article it repeats changes or is deleted
+                    duplicates.append(("chunk",chunk_id,duplicate[0],duplicate[2]))
+            yield filename,[chunk for chunk,_ in kept],[chunk_id for _,chunk_id in kept],duplicates
+
+    def batch_stage(self, chunked_documents):
+        '''Stage: To group whole documents into write batches of roughly batch_size chunks'''
+        batch=[]
+        batch_chunks=0
+        for filename,chunks,ids,duplicates in chunked_documents:
+            batch.append((filename,chunks,ids,duplicates))
+            batch_chunks+=len(chunks)
+            if batch_chunks>=self.batch_size:
+                yield batch
+                batch,batch_chunks=[],0
+        if batch:
+            yield batch
+
+    def embed_stage(self, batches):
+        '''Stage: To embed all chunks of a batch in one bulk call through the embedding cache'''
+        for batch in batches:
+            texts=[chunk.page_content for _,chunks,_,_ in batch for chunk in chunks]
+            with metrics.span("embed"):
+                vectors=self.data_loader.EMBEDDINGS.embed_documents(texts) if texts else []
+            yield batch,vectors
+
+    def write_stage(self, embedded_batches, current_hashes):
+        '''Stage: To upsert each embedded batch into vector db and record its articles in the manifest'''
+        manifest=self.data_loader.manifest
+        for batch,vectors in embedded_batches:
+            documents,ids=[],[]
+            with metrics.span("index"):
+                for filename,chunks,chunk_ids,_ in batch:
+                    #chunks beyond the new chunk count of a changed article are stale
+                    self.data_loader.delete_vectordb(set(manifest.chunk_ids_for(filename))-set(chunk_ids))
+                    documents.extend(chunks)
+                    ids.extend(chunk_ids)
+                self.data_loader.store_vectordb(documents,ids,vectors)
+            for filename,_,chunk_ids,duplicates in batch:
+                manifest.update(filename,current_hashes[filename],chunk_ids,duplicates)
+            self.written_chunks+=len(documents)
+            metrics.increment("indexed_chunks",len(documents))
+            yield len(batch)
+
+    def run(self, filenames, current_hashes):
+        '''Function: To push the given articles through every stage keeping memory bounded by the in-flight limit'''
+        articles=self.article_dedup_stage(self.read_stage(filenames))
+        chunks=self.chunk_dedup_stage(self.chunk_stage(articles))
+        stages=self.write_stage(self.embed_stage(self.batch_stage(chunks)),current_hashes)
+        ingested=0
+        #the manifest commits every written article, an interrupted run resumes where it stopped
+        for count in stages:
+            ingested+=count
+            self.logger.info(f"Ingested {ingested}/{len(filenames)} articles ({self.written_chunks} chunks)")
+        return ingested
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import queue
+import atexit
+import bisect
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+#upper bounds (seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0)
+LOG_FORMAT='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener=None
+_queue_handler=None
+_logging_lock=threading.Lock()
+
+
+def configure_logging(component, file_prefix):
+    '''Function: To log through a background queue into a size rotated file, once per process'''
+    global _listener,_queue_handler
+    logger=logging.getLogger()
+    with _logging_lock:
+        if _listener is not None:
+            return logger
+        log_dir=os.path.join(os.environ["LOG_DIR"],component)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        file_handler=RotatingFileHandler(os.path.join(log_dir,f"{file_prefix}.log"),'a',
+                                         maxBytes=int(os.environ["LOG_FILE_SIZE"]),
+                                         backupCount=int(os.environ.get("LOG_BACKUP_COUNT","5")),encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        log_queue=queue.SimpleQueue()
+        #request paths only enqueue the record, formatting and file writes happen on the listener thread
+        _listener=QueueListener(log_queue,file_handler,respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        logger.setLevel(logging.INFO)
+        _queue_handler=QueueHandler(log_queue)
+        logger.addHandler(_queue_handler)
+    return logger
+
+
+def shutdown_logging():
+    '''Function: To stop the logging listener and close the log file, logging can be configured again afterwards'''
+    global _listener,_queue_handler
+    with _logging_lock:
+        if _listener is None:
+            return
+        atexit.unregister(_listener.stop)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener,_queue_handler=None,None
+
+
+class Histogram():
+    '''Class to aggregate observations into fixed buckets'''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        '''Constructor for initialization'''
+        self.buckets=buckets
+        self.counts=[0]*(len(buckets)+1)
+        self.count=0
+        self.total=0.0
+        self.max=0.0
+
+    def observe(self, value):
+        '''Function: To add an observation'''
+        self.counts[bisect.bisect_left(self.buckets,value)]+=1
+        self.count+=1
+        self.total+=value
+        self.max=max(self.max,value)
+
+    def quantile(self, q):
+        '''Function: To estimate a quantile as the upper bound of the bucket holding it'''
+        if not self.count:
+            return None
+        rank=q*self.count
+        cumulative=0
+        for bound,count in zip(self.buckets,self.counts):
+            cumulative+=count
+            if cumulative>=rank:
+                return min(bound,self.max)
+        return self.max
+
+    def snapshot(self):
+        '''Function: To export the histogram'''
+        return {"count": self.count,"sum": self.total,"mean": self.total/self.count if self.count else None,
+                "max": self.max,"p50": self.quantile(0.5),"p99": self.quantile(0.99),
+                "buckets": dict(zip([str(bound) for bound in self.buckets]+["+Inf"],self.counts))}
+
+
+class Metrics():
+    '''Class to keep the process counters and latency histograms and export them periodically'''
+    def __init__(self):
+        '''Constructor for initialization'''
+        self._lock=threading.Lock()
+        self.counters={}
+        self.histograms={}
+        self.component=None
+        #export targets are resolved once when the export starts, the final export at exit writes to the same place
+        self.export_url=None
+        self.export_path=None
+        self._exporter=None
+        self._stop=threading.Event()
+
+    def increment(self, name, value=1):
+        '''Function: To increase a counter'''
+        with self._lock:
+            self.counters[name]=self.counters.get(name,0)+value
+
+    def observe(self, name, value):
+        '''Function: To record an observation (seconds for latencies) in a histogram'''
+        with self._lock:
+            histogram=self.histograms.get(name)
+            if histogram is None:
+                histogram=self.histograms[name]=Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage):
+        '''Function: To time a stage and record its latency, failures are counted separately'''
+        start=time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(f"{stage}_errors")
+            raise
+        finally:
+            self.observe(stage,time.perf_counter()-start)
+
+    def snapshot(self):
+        '''Function: To export all counters and histograms'''
+        with self._lock:
+            return {"component": self.component,"timestamp": time.time(),"counters": dict(self.counters),
+                    "histograms": {name: histogram.snapshot() for name,histogram in self.histograms.items()}}
+
+    def export(self):
+        '''Function: To write the snapshot to METRICS_EXPORT_URL (POST) or to the metrics file'''
+        payload=json.dumps(self.snapshot()).encode("utf-8")
+        if self.export_url:
+            request=urllib.request.Request(self.export_url,data=payload,headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request,timeout=5):
+                return
+        os.makedirs(os.path.dirname(self.export_path),exist_ok=True)
+        temp_path=f"{self.export_path}.tmp"
+        with open(temp_path,'wb') as file:
+            file.write(payload)
+        os.replace(temp_path,self.export_path)
+
+    def _export_loop(self, interval):
+        '''Function: To export the metrics every interval seconds until the process exits'''
+        while not self._stop.wait(interval):
+            try:
+                self.export()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Failed to export metrics: {e!r}")
+
+    def start_export(self, component):
+        '''Function: To start the background metrics export of an entry point, once per process'''
+        with self._lock:
+            if self._exporter is not None:
+                return
+            self.component=component
+            self.export_url=os.environ.get("METRICS_EXPORT_URL")
+            self.export_path=os.path.abspath(os.environ.get("METRICS_EXPORT_PATH",
+                                                            os.path.join(os.environ.get("LOG_DIR","./logs"),"metrics",f"{component}.json")))
+            self._exporter=threading.Thread(target=self._export_loop,args=(float(os.environ.get("METRICS_EXPORT_INTERVAL","30")),),
+                                            name="metrics-export",daemon=True)
+            self._exporter.start()
+        atexit.register(self.stop_export)
+
+    def stop_export(self):
+        '''Function: To stop the background export and write the final snapshot, the export can be started again afterwards'''
+        self._stop.set()
+        if self._exporter is not None:
+            self._exporter.join()
+        try:
+            self.export()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Failed to export metrics: {e!r}")
+        with self._lock:
+            self._exporter=None
+            self._stop=threading.Event()
+
+
+#process-wide metrics shared by every stage
+metrics=Metrics()
+
+
+def setup(component, file_prefix):
+    '''Function: To set up the shared logging and the metrics export of an entry point'''
+    logger=configure_logging(component,file_prefix)
+    metrics.start_export(component)
+    return logger
+
+
+def teardown():
+    '''Function: To undo setup, writing the final metrics snapshot now instead of at exit'''
+    atexit.unregister(metrics.stop_export)
+    if metrics._exporter is not None:
+        metrics.stop_export()
+    shutdown_logging()
@@ -0,0 +1,84 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+#documents: packed chunks in relevance order, tokens_saved: tokens of the retrieved chunks left out of the prompt
+PackedContext=namedtuple("PackedContext",["documents","tokens_used","tokens_saved","duplicates_removed","dropped"])
+
+
+class ContextPacker():
+    '''Class to drop near-duplicate chunks and fill the context token budget in relevance order'''
+    def __init__(self, encoding, embeddings, similarity_threshold=0.92, count_cache_size=8192, document_separator="\n\n"):
+        '''Constructor for initialization'''
+        self.encoding=encoding
+        self.embeddings=embeddings
+        self.similarity_threshold=similarity_threshold
+        self.count_cache_size=count_cache_size
+        #the stuff documents chain joins the chunks with this separator
+        self.separator_tokens=len(encoding.encode(document_separator))
+        #content hash -> token count, kept in LRU order
+        self._counts=OrderedDict()
+        self._lock=threading.Lock()
+
+    @classmethod
+    def from_env(cls, encoding, embeddings):
+        '''Function: To create the packer using the settings from the environment'''
+        return cls(encoding,embeddings,
+                   similarity_threshold=float(os.environ.get("CONTEXT_DUPLICATE_SIMILARITY","0.92")),
+                   count_cache_size=int(os.environ.get("CONTEXT_COUNT_CACHE_SIZE","8192")))
+
+    def token_count(self, text):
+        '''Function: To count the tokens of a chunk, encoding each distinct chunk only once'''
+        key=hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            count=self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+        count=len(self.encoding.encode(text))
+        with self._lock:
+            self._counts[key]=count
+            while len(self._counts)>self.count_cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def remove_near_duplicates(self, documents):
+        '''Function: To keep, in relevance order, only the chunks not too similar to a more relevant chunk'''
+        if len(documents)<2:
+            return list(documents)
+        try:
+            #chunk embeddings were computed at ingestion, so these are served by the embedding cache
+            vectors=np.asarray(self.embeddings.embed_documents([document.page_content for document in documents]),dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Could not embed the retrieved chunks, skipping near-duplicate removal: {e!r}")
+            return list(documents)
+        norms=np.linalg.norm(vectors,axis=1,keepdims=True)
+        vectors=vectors/np.where(norms==0,1,norms)
+        similarities=vectors@vectors.T
+        kept=[]
+        for index in range(len(documents)):
+            if not kept or similarities[index,kept].max()<self.similarity_threshold:
+                kept.append(index)
+        return [documents[index] for index in kept]
+
+    def pack(self, documents, context_budget):
+        '''Function: To pack the most relevant distinct chunks into the context token budget'''
+        counts=[self.token_count(document.page_content) for document in documents]
+        retrieved_tokens=sum(counts)+self.separator_tokens*max(len(documents)-1,0)
+        distinct=self.remove_near_duplicates(documents)
+        packed=[]
+        tokens_used=0
+        for document in distinct:
+            cost=self.token_count(document.page_content)+(self.separator_tokens if packed else 0)
+            #a chunk which does not fit is skipped, a smaller less relevant one may still fit
+            if tokens_used+cost<=context_budget:
+                packed.append(document)
+                tokens_used+=cost
+        return PackedContext(documents=packed,tokens_used=tokens_used,tokens_saved=retrieved_tokens-tokens_used,
+                             duplicates_removed=len(documents)-len(distinct),dropped=len(distinct)-len(packed))
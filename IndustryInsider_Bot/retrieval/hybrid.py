@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Any, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+from ingestion.manifest import IngestionManifest
+
+logger=logging.getLogger(__name__)
+
+
+def document_id(document):
+    '''Function: To return the chunk ID of a retrieved document, the same ID for both retrievers'''
+    metadata=document.metadata
+    #metadata["id"] is only filled in by some retrievers, keying on it would split one chunk into two entries
+    if "source" in metadata and "chunk_index" in metadata:
+        return IngestionManifest.chunk_id(metadata["source"],metadata["chunk_index"])
+    #chunks stored before chunk IDs existed are identified by their content
+    return hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()
+
+
+def weighted_rrf(result_lists, weights, c=60, k=None):
+    '''Function: To fuse ranked document lists with weighted reciprocal rank fusion, deduplicated by chunk ID'''
+    scores={}
+    documents={}
+    for result,weight in zip(result_lists,weights):
+        for rank,document in enumerate(result,start=1):
+            doc_id=document_id(document)
+            scores[doc_id]=scores.get(doc_id,0.0)+weight/(c+rank)
+            documents.setdefault(doc_id,document)
+    ranked=sorted(scores,key=scores.get,reverse=True)
+    return [documents[doc_id] for doc_id in ranked[:k]]
+
+
+def _timed_invoke(retriever, query):
+    '''Function: To run a retriever and measure its latency'''
+    start=time.perf_counter()
+    documents=retriever.invoke(query)
+    return documents,time.perf_counter()-start
+
+
+class HybridRetriever(BaseRetriever):
+    '''Retriever running the vector and keyword searches concurrently and fusing them with weighted RRF'''
+    vector_retriever: BaseRetriever
+    keyword_retriever: BaseRetriever
+    weights: Tuple[float,float]=(0.7,0.3)
+    c: int=60
+    k: int=8
+    vector_timeout: float=5.0
+    keyword_timeout: float=2.0
+    executor: Any=None
+
+    class Config:
+        arbitrary_types_allowed=True
+
+    def __init__(self, **kwargs):
+        '''Constructor for initialization'''
+        super().__init__(**kwargs)
+        if self.executor is None:
+            #shared by every session, a timed out search keeps its worker until it returns
+            self.executor=ThreadPoolExecutor(max_workers=int(os.environ.get("RETRIEVER_WORKERS","8")),thread_name_prefix="retriever")
+
+    @classmethod
+    def from_env(cls, vector_retriever, keyword_retriever):
+        '''Function: To create the hybrid retriever using the settings from the environment'''
+        weights=tuple(float(weight) for weight in os.environ.get("RETRIEVER_WEIGHTS","0.7,0.3").split(","))
+        return cls(vector_retriever=vector_retriever,keyword_retriever=keyword_retriever,weights=weights,
+                   c=int(os.environ.get("RRF_C","60")),
+                   k=int(os.environ.get("RETRIEVER_TOP_K","8")),
+                   vector_timeout=float(os.environ.get("VECTOR_RETRIEVER_TIMEOUT","5")),
+                   keyword_timeout=float(os.environ.get("KEYWORD_RETRIEVER_TIMEOUT","2")))
+
+    def _collect(self, name, future, deadline, timings):
+        '''Function: To wait for one search till its deadline, an empty result on timeout or failure'''
+        try:
+            documents,elapsed=future.result(timeout=max(0.0,deadline-time.perf_counter()))
+            timings[name]=elapsed
+            return documents
+        except FutureTimeoutError:
+            timings[name]=None
+            logger.warning(f"{name} retriever timed out, continuing without its results")
+        except Exception as e:
+            timings[name]=None
+            logger.error(f"{name} retriever failed, continuing without its results: {e!r}")
+        return []
+
+    def retrieve_with_timings(self, query: str) -> Tuple[List[Document],Dict[str,Any]]:
+        '''Function: To retrieve the fused documents along with the latency of each retriever'''
+        start=time.perf_counter()
+        vector_future=self.executor.submit(_timed_invoke,self.vector_retriever,query)
+        keyword_future=self.executor.submit(_timed_invoke,self.keyword_retriever,query)
+        timings={}
+        #keyword search is collected first, it is the fallback when the embedding call is slow
+        keyword_documents=self._collect("keyword",keyword_future,start+self.keyword_timeout,timings)
+        vector_documents=self._collect("vector",vector_future,start+self.vector_timeout,timings)
+        documents=weighted_rrf([vector_documents,keyword_documents],self.weights,self.c,self.k)
+        timings["total"]=time.perf_counter()-start
+        timings["fallback"]=timings["vector"] is None
+        return documents,timings
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        '''Function: To fetch the fused documents for the query'''
+        documents,timings=self.retrieve_with_timings(query)
+        logger.info(f"Hybrid retrieval latency: {timings}")
+        return documents
@@ -0,0 +1,173 @@
+import os
+import json
+import math
+import heapq
+import sqlite3
+import threading
+from collections import Counter
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+
+def default_preprocessing_func(text):
+    '''Function: To tokenize text the same way BM25Retriever does by default'''
+    return text.split()
+
+
+class KeywordIndex():
+    '''Class to keep a BM25 inverted index on disk which can be updated incrementally'''
+    def __init__(self, index_dir, k1=1.5, b=0.75, max_df_ratio=0.5, preprocess_func=default_preprocessing_func):
+        '''Constructor for initialization'''
+        self.k1=k1
+        self.b=b
+        self.max_df_ratio=max_df_ratio
+        self.preprocess_func=preprocess_func
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self.index_path=os.path.join(index_dir,"bm25.sqlite3")
+        #postings are read through a memory map so processes share them via the page cache
+        self.mmap_bytes=int(os.environ.get('KEYWORD_INDEX_MMAP_BYTES',str(1024*1024*1024)))
+        #the lock only serializes writes, searches run on a read connection per thread
+        self._lock=threading.Lock()
+        self._local=threading.local()
+        self._conn=sqlite3.connect(self.index_path,check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA mmap_size={self.mmap_bytes}")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents(doc_id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT, length INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS postings(term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY(term,doc_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+            CREATE TABLE IF NOT EXISTS stats(key TEXT PRIMARY KEY, value REAL NOT NULL);
+            INSERT OR IGNORE INTO stats VALUES('doc_count',0),('total_length',0);
+        """)
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        '''Function: To open the keyword index stored next to the vector db'''
+        vector_path=os.path.abspath(os.environ["VECTOR_PATH"])
+        return cls(os.environ.get("KEYWORD_INDEX_PATH",os.path.join(os.path.dirname(vector_path),"keyword_index")))
+
+    def _reader(self):
+        '''Function: To return the read connection of the calling thread, WAL lets it read while a write is in progress'''
+        conn=getattr(self._local,"conn",None)
+        if conn is None:
+            conn=sqlite3.connect(self.index_path,isolation_level=None)
+            conn.execute(f"PRAGMA mmap_size={self.mmap_bytes}")
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn=conn
+        return conn
+
+    def _stats(self, conn=None):
+        '''Function: To read the corpus size and total token length'''
+        stats=dict((conn or self._conn).execute("SELECT key, value FROM stats").fetchall())
+        return int(stats["doc_count"]),stats["total_length"]
+
+    def _remove(self, ids):
+        '''Function: To remove documents and their postings without committing'''
+        removed,removed_length=0,0
+        for doc_id in ids:
+            row=self._conn.execute("SELECT length FROM documents WHERE doc_id=?",(doc_id,)).fetchone()
+            if row is None:
+                continue
+            self._conn.execute("DELETE FROM postings WHERE doc_id=?",(doc_id,))
+            self._conn.execute("DELETE FROM documents WHERE doc_id=?",(doc_id,))
+            removed+=1
+            removed_length+=row[0]
+        self._conn.execute("UPDATE stats SET value=value-? WHERE key='doc_count'",(removed,))
+        self._conn.execute("UPDATE stats SET value=value-? WHERE key='total_length'",(removed_length,))
+
+    def add_documents(self, ids, documents):
+        '''Function: To add or replace documents in the index'''
+        with self._lock:
+            self._remove(ids)
+            total_length=0
+            for doc_id,document in zip(ids,documents):
+                tokens=self.preprocess_func(document.page_content)
+                total_length+=len(tokens)
+                self._conn.execute("INSERT INTO documents VALUES(?,?,?,?)",
+                                   (doc_id,document.page_content,json.dumps(document.metadata),len(tokens)))
+                self._conn.executemany("INSERT INTO postings VALUES(?,?,?)",
+                                       [(term,doc_id,tf) for term,tf in Counter(tokens).items()])
+            self._conn.execute("UPDATE stats SET value=value+? WHERE key='doc_count'",(len(ids),))
+            self._conn.execute("UPDATE stats SET value=value+? WHERE key='total_length'",(total_length,))
+            self._conn.commit()
+
+    def delete(self, ids):
+        '''Function: To delete documents from the index'''
+        with self._lock:
+            self._remove(ids)
+            self._conn.commit()
+
+    def count(self):
+        '''Function: To return the number of indexed documents'''
+        with self._lock:
+            return self._stats()[0]
+
+    def rebuild_from_vectordb(self, vector_db, batch_size=1000):
+        '''Function: To build the index from the documents already stored in vector db, batch by batch'''
+        offset=0
+        while True:
+            data=vector_db.get(limit=batch_size,offset=offset,include=["documents","metadatas"])
+            if not data["ids"]:
+                break
+            documents=[Document(page_content=text,metadata=metadata or {})
+                       for text,metadata in zip(data["documents"],data["metadatas"])]
+            self.add_documents(data["ids"],documents)
+            offset+=len(data["ids"])
+        return offset
+
+    def search(self, query, k=5):
+        '''Function: To return the top k documents for the query scored with BM25'''
+        terms=list(set(self.preprocess_func(query)))
+        if not terms:
+            return []
+        conn=self._reader()
+        #one read transaction, so the statistics and the postings come from the same snapshot
+        conn.execute("BEGIN")
+        try:
+            doc_count,total_length=self._stats(conn)
+            if doc_count==0:
+                return []
+            avg_length=total_length/doc_count
+            placeholders=','.join('?'*len(terms))
+            doc_freqs=dict(conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term",terms).fetchall())
+            #very common terms barely change the ranking but dominate the cost, skip them when possible
+            selective=[term for term,df in doc_freqs.items() if df<=self.max_df_ratio*doc_count]
+            terms=selective or list(doc_freqs)
+            if not terms:
+                return []
+            idf={term:math.log(1+(doc_count-doc_freqs[term]+0.5)/(doc_freqs[term]+0.5)) for term in terms}
+            placeholders=','.join('?'*len(terms))
+            scores={}
+            for term,doc_id,tf,length in conn.execute(
+                    f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN documents d ON d.doc_id=p.doc_id WHERE p.term IN ({placeholders})",terms):
+                norm=tf*(self.k1+1)/(tf+self.k1*(1-self.b+self.b*length/avg_length))
+                scores[doc_id]=scores.get(doc_id,0.0)+idf[term]*norm
+            top=heapq.nlargest(k,scores.items(),key=lambda item:item[1])
+            documents=[]
+            for doc_id,score in top:
+                content,metadata=conn.execute("SELECT content, metadata FROM documents WHERE doc_id=?",(doc_id,)).fetchone()
+                metadata=json.loads(metadata) if metadata else {}
+                metadata["id"]=doc_id
+                documents.append(Document(page_content=content,metadata=metadata))
+        finally:
+            conn.execute("COMMIT")
+        return documents
+
+
+class PersistentBM25Retriever(BaseRetriever):
+    '''Retriever running BM25 over the persisted keyword index'''
+    index: KeywordIndex
+    k: int=5
+
+    class Config:
+        arbitrary_types_allowed=True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        '''Function: To fetch the top k documents for the query'''
+        return self.index.search(query,k=self.k)
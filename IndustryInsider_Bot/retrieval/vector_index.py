@@ -0,0 +1,403 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, List
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+from instrumentation.telemetry import metrics
+
+logger=logging.getLogger(__name__)
+
+#embeddings_queue vector encodings written by chroma
+VECTOR_ENCODINGS={"FLOAT32": np.float32, "INT32": np.int32}
+#int8 is dequantized with simd, float16 only pays off where memory matters more than latency
+DTYPES=("float32","float16","int8")
+
+
+def vector_index_path():
+    '''Function: To return the directory of the memory-mapped vector index, kept next to the vector db'''
+    vector_path=os.path.abspath(os.environ["VECTOR_PATH"])
+    return os.environ.get("VECTOR_INDEX_PATH",os.path.join(os.path.dirname(vector_path),"vector_index"))
+
+
+def _metadata_value(string_value, int_value, float_value, bool_value):
+    '''Function: To read a metadata value from the typed columns of chroma'''
+    if string_value is not None:
+        return string_value
+    if int_value is not None:
+        return int_value
+    if float_value is not None:
+        return float_value
+    if bool_value is not None:
+        return bool(bool_value)
+    return None
+
+
+def read_chroma(vector_path, collection_name="langchain", batch_size=500):
+    '''Function: To read the stored chunks and their vectors straight from chroma.sqlite3, returns (count, dimensions, batches)'''
+    conn=sqlite3.connect(f"file:{os.path.join(os.path.abspath(vector_path),'chroma.sqlite3')}?mode=ro",uri=True,check_same_thread=False)
+    row=conn.execute("SELECT id, dimension FROM collections WHERE name=?",(collection_name,)).fetchone()
+    if row is None:
+        conn.close()
+        raise ValueError(f"Collection '{collection_name}' not found in {vector_path}")
+    collection_id,dimensions=row
+    segment_id=conn.execute("SELECT id FROM segments WHERE collection=? AND scope='METADATA'",(collection_id,)).fetchone()[0]
+    count=conn.execute("SELECT COUNT(*) FROM embeddings WHERE segment_id=?",(segment_id,)).fetchone()[0]
+
+    def batches():
+        try:
+            cursor=conn.execute("SELECT id, embedding_id FROM embeddings WHERE segment_id=? ORDER BY id",(segment_id,))
+            while True:
+                rows=cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                row_ids=[row_id for row_id,_ in rows]
+                ids=[embedding_id for _,embedding_id in rows]
+                placeholders=','.join('?'*len(rows))
+                metadatas={row_id: {} for row_id in row_ids}
+                for row_id,key,*values in conn.execute(
+                        f"SELECT id, key, string_value, int_value, float_value, bool_value FROM embedding_metadata WHERE id IN ({placeholders})",row_ids):
+                    metadatas[row_id][key]=_metadata_value(*values)
+                #the newest write of an id carries its current vector, deletes carry none
+                vectors={}
+                for embedding_id,vector,encoding in conn.execute(
+                        f"SELECT id, vector, encoding FROM embeddings_queue WHERE topic LIKE ? AND vector IS NOT NULL AND id IN ({placeholders}) ORDER BY seq_id",
+                        [f"%/{collection_id}"]+ids):
+                    vectors[embedding_id]=np.frombuffer(vector,dtype=VECTOR_ENCODINGS[encoding or "FLOAT32"])
+                missing=[embedding_id for embedding_id in ids if embedding_id not in vectors]
+                if missing:
+                    vectors.update(_read_chroma_client(vector_path,collection_name,missing))
+                documents=[]
+                for row_id,embedding_id in rows:
+                    metadata=metadatas[row_id]
+                    content=metadata.pop("chroma:document",None) or ""
+                    documents.append(Document(page_content=content,metadata=metadata))
+                yield ids,np.stack([vectors[embedding_id] for embedding_id in ids]).astype(np.float32),documents
+        finally:
+            conn.close()
+    return count,dimensions,batches()
+
+
+def _read_chroma_client(vector_path, collection_name, ids):
+    '''Function: To fetch vectors through the chroma client when chroma already purged them from its write-ahead queue'''
+    import chromadb
+    collection=chromadb.PersistentClient(path=vector_path).get_collection(collection_name)
+    data=collection.get(ids=ids,include=["embeddings"])
+    return {embedding_id: np.asarray(vector,dtype=np.float32) for embedding_id,vector in zip(data["ids"],data["embeddings"])}
+
+
+def _normalize(vectors):
+    '''Function: To scale the rows to unit length so the dot product is the cosine similarity'''
+    norms=np.linalg.norm(vectors,axis=1,keepdims=True)
+    norms[norms==0]=1.0
+    return vectors/norms
+
+
+def train_lists(vectors, lists, iterations=10, sample_size=None, seed=0):
+    '''Function: To partition the vectors into lists with spherical k-means on a sample, returns the centroids'''
+    rng=np.random.default_rng(seed)
+    sample_size=min(len(vectors),sample_size or lists*64)
+    sample=np.asarray(vectors[np.sort(rng.choice(len(vectors),sample_size,replace=False))],dtype=np.float32)
+    centroids=sample[rng.choice(sample_size,lists,replace=False)].copy()
+    for _ in range(iterations):
+        assignments=np.argmax(sample@centroids.T,axis=1)
+        sums=np.zeros_like(centroids)
+        np.add.at(sums,assignments,sample)
+        #empty lists are moved onto random sample vectors
+        empty=np.bincount(assignments,minlength=lists)==0
+        sums[empty]=sample[rng.choice(sample_size,int(empty.sum()))]
+        centroids=_normalize(sums)
+    return centroids
+
+
+class MmapVectorIndex():
+    '''Class to search normalized, quantized vectors memory mapped from disk, shared by processes through the page cache'''
+    def __init__(self, build_dir):
+        '''Constructor for initialization'''
+        self.build_dir=build_dir
+        #searches in flight, a retired index is closed once the last of them is done
+        self._users=0
+        self._retired=False
+        self._users_lock=threading.Lock()
+        with open(os.path.join(build_dir,"manifest.json"),'r',encoding="utf-8") as file:
+            self.manifest=json.load(file)
+        self.dtype=self.manifest["dtype"]
+        self.count=self.manifest["count"]
+        self.dimensions=self.manifest["dimensions"]
+        self.source_version=self.manifest.get("source_version")
+        #only the pages touched by a search are read, opening costs no I/O
+        self.vectors=np.load(os.path.join(build_dir,"vectors.npy"),mmap_mode='r')
+        self.scales=np.load(os.path.join(build_dir,"scales.npy"),mmap_mode='r') if self.dtype=="int8" else None
+        #document i is stored in documents.bin between offsets[i] and offsets[i+1]
+        self.offsets=np.load(os.path.join(build_dir,"offsets.npy"),mmap_mode='r')
+        self._documents_file=open(os.path.join(build_dir,"documents.bin"),'rb')
+        self._documents=mmap.mmap(self._documents_file.fileno(),0,access=mmap.ACCESS_READ) if self.count else b""
+        self.centroids=None
+        self.list_offsets=None
+        if self.manifest.get("lists"):
+            self.centroids=np.load(os.path.join(build_dir,"centroids.npy"))
+            self.list_offsets=np.load(os.path.join(build_dir,"list_offsets.npy"))
+
+    @staticmethod
+    def current_build(index_dir):
+        '''Function: To read the name of the build currently served from the index directory'''
+        try:
+            with open(os.path.join(index_dir,"CURRENT"),'r',encoding="utf-8") as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open(cls, index_dir):
+        '''Function: To open the current build of the index, None when nothing was exported yet'''
+        build=cls.current_build(index_dir)
+        return cls(os.path.join(index_dir,build)) if build else None
+
+    @classmethod
+    def build(cls, index_dir, batches, count, dimensions, dtype="int8", lists=0, source_version=None, block_rows=65536):
+        '''Function: To write a new build of the index from (ids, vectors, documents) batches and make it the current one'''
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector index dtype '{dtype}', expected one of {DTYPES}")
+        name=f"build-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        build_dir=os.path.join(index_dir,name)
+        os.makedirs(build_dir)
+        #vectors and documents are staged in ingestion order, then written in list order
+        staging=open_memmap(os.path.join(build_dir,"staging.npy"),mode='w+',dtype=np.float32,shape=(count,dimensions))
+        staged_offsets=np.zeros(count+1,dtype=np.int64)
+        position=0
+        with open(os.path.join(build_dir,"documents.tmp"),'wb') as file:
+            for ids,vectors,documents in batches:
+                staging[position:position+len(ids)]=_normalize(np.asarray(vectors,dtype=np.float32))
+                for doc_id,document in zip(ids,documents):
+                    record=json.dumps({"id": doc_id,"page_content": document.page_content,"metadata": document.metadata}).encode("utf-8")
+                    file.write(record)
+                    staged_offsets[position+1]=staged_offsets[position]+len(record)
+                    position+=1
+        if position!=count:
+            raise ValueError(f"Expected {count} vectors, read {position}")
+
+        order=np.arange(count)
+        manifest={"dtype": dtype,"count": count,"dimensions": dimensions,"lists": 0,"source_version": source_version,
+                  "created_at": time.time()}
+        if lists and count>=lists:
+            centroids=train_lists(staging,lists)
+            assignments=np.concatenate([np.argmax(staging[start:start+block_rows]@centroids.T,axis=1)
+                                        for start in range(0,count,block_rows)])
+            #vectors of a list are stored contiguously so probing it is one sequential read
+            order=np.argsort(assignments,kind="stable")
+            list_offsets=np.concatenate([[0],np.cumsum(np.bincount(assignments,minlength=lists))]).astype(np.int64)
+            np.save(os.path.join(build_dir,"centroids.npy"),centroids.astype(np.float32))
+            np.save(os.path.join(build_dir,"list_offsets.npy"),list_offsets)
+            manifest["lists"]=lists
+
+        vectors=open_memmap(os.path.join(build_dir,"vectors.npy"),mode='w+',dtype=np.dtype(dtype),shape=(count,dimensions))
+        scales=open_memmap(os.path.join(build_dir,"scales.npy"),mode='w+',dtype=np.float32,shape=(count,)) if dtype=="int8" else None
+        for start in range(0,count,block_rows):
+            block=np.asarray(staging[order[start:start+block_rows]])
+            if dtype=="int8":
+                #symmetric per vector scale, the score is the int8 dot product times the scale
+                block_scales=np.abs(block).max(axis=1)/127.0
+                block_scales[block_scales==0]=1.0
+                vectors[start:start+len(block)]=np.round(block/block_scales[:,None]).astype(np.int8)
+                scales[start:start+len(block)]=block_scales
+            else:
+                vectors[start:start+len(block)]=block.astype(dtype)
+        vectors.flush()
+        if scales is not None:
+            scales.flush()
+        del staging,vectors,scales
+
+        offsets=np.zeros(count+1,dtype=np.int64)
+        with open(os.path.join(build_dir,"documents.tmp"),'rb') as source,open(os.path.join(build_dir,"documents.bin"),'wb') as target:
+            staged=mmap.mmap(source.fileno(),0,access=mmap.ACCESS_READ) if count else b""
+            for position,row in enumerate(order):
+                record=staged[staged_offsets[row]:staged_offsets[row+1]]
+                target.write(record)
+                offsets[position+1]=offsets[position]+len(record)
+            if count:
+                staged.close()
+        np.save(os.path.join(build_dir,"offsets.npy"),offsets)
+        os.remove(os.path.join(build_dir,"documents.tmp"))
+        os.remove(os.path.join(build_dir,"staging.npy"))
+        with open(os.path.join(build_dir,"manifest.json"),'w',encoding="utf-8") as file:
+            json.dump(manifest,file)
+
+        #readers switch over atomically, processes still mapping an old build keep reading it
+        current_path=os.path.join(index_dir,"CURRENT")
+        with open(f"{current_path}.{name}.tmp",'w',encoding="utf-8") as file:
+            file.write(name)
+        os.replace(f"{current_path}.{name}.tmp",current_path)
+        #older complete builds only, another export may still be writing its build
+        for entry in os.listdir(index_dir):
+            if entry.startswith("build-") and entry<name and os.path.exists(os.path.join(index_dir,entry,"manifest.json")):
+                shutil.rmtree(os.path.join(index_dir,entry),ignore_errors=True)
+        return cls(build_dir)
+
+    def _scores(self, start, end, queries):
+        '''Function: To score the stored rows start..end against the queries, shape (queries, rows)'''
+        block=np.asarray(self.vectors[start:end],dtype=np.float32)
+        scores=queries@block.T
+        if self.scales is not None:
+            scores*=self.scales[start:end]
+        return scores
+
+    def search(self, query_vectors, k=4, probes=8, block_rows=4096):
+        '''Function: To return the top k (rows, scores) of every query, one matrix product per block or probed list'''
+        #blocks are small enough for their dequantized copy to stay in the cpu cache
+        queries=_normalize(np.atleast_2d(np.asarray(query_vectors,dtype=np.float32)))
+        k=min(k,self.count)
+        best_scores=np.full((len(queries),k),-np.inf,dtype=np.float32)
+        best_rows=np.full((len(queries),k),-1,dtype=np.int64)
+        if self.centroids is None:
+            ranges=[(start,min(start+block_rows,self.count),np.arange(len(queries))) for start in range(0,self.count,block_rows)]
+        else:
+            #only the lists closest to a query are scanned, queries probing the same list share one product
+            probed=np.argsort(-(queries@self.centroids.T),axis=1)[:,:probes]
+            ranges=[]
+            for list_id in np.unique(probed):
+                query_rows=np.nonzero((probed==list_id).any(axis=1))[0]
+                list_start,list_end=int(self.list_offsets[list_id]),int(self.list_offsets[list_id+1])
+                ranges.extend((start,min(start+block_rows,list_end),query_rows) for start in range(list_start,list_end,block_rows))
+        for start,end,query_rows in ranges:
+            scores=np.concatenate([best_scores[query_rows],self._scores(start,end,queries[query_rows])],axis=1)
+            rows=np.concatenate([best_rows[query_rows],np.broadcast_to(np.arange(start,end),(len(query_rows),end-start))],axis=1)
+            top=np.argpartition(-scores,k-1,axis=1)[:,:k]
+            best_scores[query_rows]=np.take_along_axis(scores,top,axis=1)
+            best_rows[query_rows]=np.take_along_axis(rows,top,axis=1)
+        order=np.argsort(-best_scores,axis=1)
+        return np.take_along_axis(best_rows,order,axis=1),np.take_along_axis(best_scores,order,axis=1)
+
+    def documents(self, rows):
+        '''Function: To read the documents of the given rows through the offset table'''
+        documents=[]
+        for row in rows:
+            if row<0:
+                continue
+            record=json.loads(self._documents[self.offsets[row]:self.offsets[row+1]])
+            metadata=record["metadata"]
+            metadata["id"]=record["id"]
+            documents.append(Document(page_content=record["page_content"],metadata=metadata))
+        return documents
+
+    def acquire(self):
+        '''Function: To register a search on this index so retiring it waits for the search'''
+        with self._users_lock:
+            self._users+=1
+        return self
+
+    def release(self):
+        '''Function: To end a search, closing the index when it was retired meanwhile'''
+        with self._users_lock:
+            self._users-=1
+            close=self._retired and self._users==0
+        if close:
+            self.close()
+
+    def retire(self):
+        '''Function: To close the index now or, when searches are still running on it, after the last one'''
+        with self._users_lock:
+            self._retired=True
+            close=self._users==0
+        if close:
+            self.close()
+
+    def close(self):
+        '''Function: To release the memory maps'''
+        if self.count:
+            self._documents.close()
+        self._documents_file.close()
+        #the numpy maps are unmapped once no array refers to them anymore
+        self.vectors=self.scales=self.offsets=None
+
+
+def export_from_env(source_version=None, vector_path=None, index_dir=None):
+    '''Function: To export the chroma collection configured in the environment into a new build of the vector index'''
+    count,dimensions,batches=read_chroma(vector_path or os.environ["VECTOR_PATH"],os.environ.get("VECTOR_COLLECTION","langchain"))
+    lists=os.environ.get("VECTOR_INDEX_LISTS","auto")
+    if lists=="auto":
+        #partitioning only pays off once a flat scan gets expensive
+        lists=int(np.sqrt(count)) if count>=int(os.environ.get("VECTOR_INDEX_IVF_MIN_VECTORS","50000")) else 0
+    with metrics.span("vector_index_export"):
+        index=MmapVectorIndex.build(index_dir or vector_index_path(),batches,count,dimensions,
+                                    dtype=os.environ.get("VECTOR_INDEX_DTYPE","int8"),lists=int(lists),source_version=source_version)
+    logger.info(f"Exported {count} vectors into the {index.dtype} vector index {index.build_dir} ({index.manifest['lists']} lists)")
+    return index
+
+
+class VectorIndexRetriever(BaseRetriever):
+    '''Retriever running the vector search over the memory-mapped index, returning the documents like the Chroma retriever'''
+    index_dir: str
+    embeddings: Any
+    k: int=4
+    probes: int=8
+    index: Any=None
+    swap_lock: Any=None
+
+    class Config:
+        arbitrary_types_allowed=True
+
+    def __init__(self, **kwargs):
+        '''Constructor for initialization'''
+        super().__init__(**kwargs)
+        if self.swap_lock is None:
+            self.swap_lock=threading.Lock()
+
+    @classmethod
+    def from_env(cls, embeddings):
+        '''Function: To create the retriever over the index configured in the environment'''
+        return cls(index_dir=vector_index_path(),embeddings=embeddings,
+                   k=int(os.environ.get("VECTOR_INDEX_TOP_K","4")),
+                   probes=int(os.environ.get("VECTOR_INDEX_PROBES","8")))
+
+    @contextmanager
+    def current_index(self):
+        '''Function: To use the opened index for one search, switching over when a newer build was exported'''
+        with self.swap_lock:
+            build=MmapVectorIndex.current_build(self.index_dir)
+            if build is None:
+                raise FileNotFoundError(f"No vector index exported to {self.index_dir}")
+            if self.index is None or os.path.basename(self.index.build_dir)!=build:
+                try:
+                    opened=MmapVectorIndex(os.path.join(self.index_dir,build))
+                except FileNotFoundError:
+                    #a newer export replaced the build and removed it between reading CURRENT and opening it
+                    opened=MmapVectorIndex.open(self.index_dir)
+                retired,self.index=self.index,opened
+                #searches still running on the old build keep it open until they are done
+                if retired is not None:
+                    retired.retire()
+            index=self.index.acquire()
+        try:
+            yield index
+        finally:
+            index.release()
+
+    def search_batch(self, queries):
+        '''Function: To retrieve the documents of many queries with one batched search'''
+        with self.current_index() as index:
+            if not queries or index.count==0:
+                return [[] for _ in queries]
+            #queries are embedded as queries, like in _get_relevant_documents, some models embed documents differently
+            query_vectors=[self.embeddings.embed_query(query) for query in queries]
+            rows,_=index.search(query_vectors,k=self.k,probes=self.probes)
+            return [index.documents(query_rows) for query_rows in rows]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        '''Function: To retrieve the documents closest to the query'''
+        with self.current_index() as index:
+            if index.count==0:
+                return []
+            rows,_=index.search(self.embeddings.embed_query(query),k=self.k,probes=self.probes)
+            return index.documents(rows[0])
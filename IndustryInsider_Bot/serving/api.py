@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from instrumentation.telemetry import metrics
+
+logger=logging.getLogger(__name__)
+
+#handed over by the worker thread once the answer is complete
+_DONE=object()
+
+
+class AdmissionController():
+    '''Class to bound the requests being served and waiting for a slot, rejecting the rest early'''
+    def __init__(self, max_concurrent, max_queued, queue_timeout):
+        '''Constructor for initialization'''
+        self.max_concurrent=max_concurrent
+        self.max_queued=max_queued
+        self.queue_timeout=queue_timeout
+        self._semaphore=asyncio.Semaphore(max_concurrent)
+        self.active=0
+        self.waiting=0
+        self.rejected=0
+
+    async def acquire(self):
+        '''Function: To wait for a free slot, False when too many requests wait already or the wait timed out'''
+        #counted synchronously, the semaphore only changes once the waiting task runs
+        if self.active+self.waiting>=self.max_concurrent+self.max_queued:
+            self.rejected+=1
+            return False
+        self.waiting+=1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(),self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected+=1
+            return False
+        finally:
+            self.waiting-=1
+        self.active+=1
+        return True
+
+    def release(self):
+        '''Function: To free the slot of a finished request'''
+        self.active-=1
+        self._semaphore.release()
+
+    def stats(self):
+        '''Function: To report the admission counters'''
+        return {"active": self.active,"waiting": self.waiting,"rejected": self.rejected,
+                "max_concurrent": self.max_concurrent,"max_queued": self.max_queued}
+
+
+class ChatServer():
+    '''Class to serve the rag pipeline over HTTP, streaming answers as server-sent events'''
+    def __init__(self, resources, max_workers=8, max_queued=32, queue_timeout=10.0, stream_buffer=32, max_question_chars=4000):
+        '''Constructor for initialization'''
+        self.resources=resources
+        self.max_workers=max_workers
+        self.max_queued=max_queued
+        self.queue_timeout=queue_timeout
+        #chunks buffered per response before the worker has to wait for a slow client
+        self.stream_buffer=stream_buffer
+        self.max_question_chars=max_question_chars
+        self.executor=None
+        self.admission=None
+        #turns of the same conversation are answered one after the other
+        self._session_locks=weakref.WeakValueDictionary()
+        self.app=web.Application()
+        self.app.add_routes([web.post("/v1/chat",self.chat),web.get("/healthz",self.health),web.get("/metrics",self.export_metrics)])
+        self.app.on_startup.append(self._startup)
+        self.app.on_cleanup.append(self._cleanup)
+
+    @classmethod
+    def from_env(cls, resources):
+        '''Function: To create the server using the settings from the environment'''
+        return cls(resources,
+                   max_workers=int(os.environ.get("API_WORKERS","8")),
+                   max_queued=int(os.environ.get("API_MAX_QUEUED","32")),
+                   queue_timeout=float(os.environ.get("API_QUEUE_TIMEOUT","10")),
+                   stream_buffer=int(os.environ.get("API_STREAM_BUFFER","32")),
+                   max_question_chars=int(os.environ.get("API_MAX_QUESTION_CHARS","4000")))
+
+    async def _startup(self, app):
+        '''Function: To create the worker pool and warm the shared resources before serving'''
+        #every admitted request holds one worker while its answer is generated
+        self.executor=ThreadPoolExecutor(max_workers=self.max_workers,thread_name_prefix="api-worker")
+        self.admission=AdmissionController(self.max_workers,self.max_queued,self.queue_timeout)
+        startup=await asyncio.get_running_loop().run_in_executor(self.executor,self.resources.warm_up)
+        logger.info(f"API server ready ({'cold' if startup['cold'] else 'warm'} start: {startup['elapsed_seconds']:.3f}s)")
+
+    async def _cleanup(self, app):
+        '''Function: To stop the worker pool'''
+        self.executor.shutdown(wait=False,cancel_futures=True)
+
+    def _session_lock(self, session_id):
+        '''Function: To return the lock serializing the turns of a conversation'''
+        lock=self._session_locks.get(session_id)
+        if lock is None:
+            lock=asyncio.Lock()
+            self._session_locks[session_id]=lock
+        return lock
+
+    def _produce(self, loop, queue, cancelled, question, session_id):
+        '''Function: To run the blocking pipeline on a worker thread, handing the chunks over to the event loop'''
+        def put(item):
+            #nobody reads any more once the client went away
+            if cancelled.is_set():
+                return
+            #blocks the worker while the client reads slower than the llm writes (backpressure)
+            asyncio.run_coroutine_threadsafe(queue.put(item),loop).result()
+        try:
+            session=self.resources.session_store.get(session_id)
+            chunks=self.resources.rag_pipeline.stream(question,session.history,session.ledger)
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        break
+                    put(chunk)
+            finally:
+                #releases the llm stream, the worker is free once the in-flight generation returns
+                chunks.close()
+            if not cancelled.is_set():
+                self.resources.session_store.persist(session)
+            put(_DONE)
+        except Exception as e:
+            logger.exception("An error occurred in generating the response")
+            put(e)
+
+    @staticmethod
+    async def _send(response, event, data):
+        '''Function: To write one server-sent event'''
+        await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+    async def chat(self, request):
+        '''Function: To answer a question of a conversation, streaming the answer as server-sent events'''
+        try:
+            body=await request.json()
+        except (json.JSONDecodeError,UnicodeDecodeError):
+            return web.json_response({"error": "request body must be JSON"},status=400)
+        question=str(body.get("question","")).strip() if isinstance(body,dict) else ""
+        if not question:
+            return web.json_response({"error": "question is required"},status=400)
+        if len(question)>self.max_question_chars:
+            return web.json_response({"error": "question is too long"},status=413)
+        session_id=str(body.get("session_id") or uuid.uuid4().hex)
+        if not await self.admission.acquire():
+            metrics.increment("api_rejected")
+            return web.json_response({"error": "server is busy, retry later"},status=503,headers={"Retry-After": "1"})
+        try:
+            async with self._session_lock(session_id):
+                return await self._stream_answer(request,question,session_id)
+        finally:
+            self.admission.release()
+
+    async def _stream_answer(self, request, question, session_id):
+        '''Function: To stream the answer produced on the worker pool to the client'''
+        loop=asyncio.get_running_loop()
+        queue=asyncio.Queue(maxsize=self.stream_buffer)
+        cancelled=threading.Event()
+        start=time.perf_counter()
+        response=web.StreamResponse(headers={"Content-Type": "text/event-stream","Cache-Control": "no-cache","X-Accel-Buffering": "no"})
+        await response.prepare(request)
+        producer=loop.run_in_executor(self.executor,self._produce,loop,queue,cancelled,question,session_id)
+        try:
+            await self._send(response,"session",{"session_id": session_id})
+            while True:
+                item=await queue.get()
+                if item is _DONE:
+                    await self._send(response,"done",{"session_id": session_id,"elapsed_seconds": time.perf_counter()-start})
+                    break
+                if isinstance(item,Exception):
+                    await self._send(response,"error",{"error": "failed to generate the response"})
+                    break
+                await self._send(response,"token",{"text": item})
+        except (ConnectionResetError,asyncio.CancelledError) as e:
+            #client went away: stop the worker, emptying the buffer unblocks a hand over already waiting
+            cancelled.set()
+            metrics.increment("api_disconnects")
+            while not queue.empty():
+                queue.get_nowait()
+            if isinstance(e,asyncio.CancelledError):
+                raise
+            return response
+        await producer
+        metrics.observe("api_request",time.perf_counter()-start)
+        await response.write_eof()
+        return response
+
+    async def health(self, request):
+        '''Function: To report whether the server accepts requests'''
+        return web.json_response({"status": "ok","admission": self.admission.stats()})
+
+    async def export_metrics(self, request):
+        '''Function: To export the counters and latency histograms of this process'''
+        return web.json_response(metrics.snapshot())
@@ -0,0 +1,85 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from instrumentation.telemetry import metrics
+
+logger=logging.getLogger(__name__)
+
+#words and phrases which usually point back at an earlier turn of the conversation
+REFERENCE_PATTERN=re.compile(r"\b("
+    r"it|its|it's|they|them|their|theirs|he|him|his|she|her|hers|this|that|these|those|there|"
+    r"such|same|above|previous|previously|earlier|former|latter|mentioned|said|"
+    r"the company|the firm|the project|the order|the deal|"
+    r"also|else|more|another|other|again|too|what about|how about|and what|why not"
+    r")\b",re.IGNORECASE)
+
+
+def history_digest(chat_history):
+    '''Function: To compute a digest identifying the content of a chat history'''
+    digest=hashlib.sha1()
+    for message in chat_history:
+        digest.update(f"{message.type}\x1f{message.content}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class QueryCondenser():
+    '''Class to turn a follow-up question into a standalone question, calling the LLM only when needed'''
+    def __init__(self, question_chain, cache_size=1024, short_question_words=3):
+        '''Constructor for initialization'''
+        self.question_chain=question_chain
+        self.cache_size=cache_size
+        #questions this short ("why?", "and Tata?") lean on the history even without a reference word
+        self.short_question_words=short_question_words
+        #(history digest, question) -> standalone question, kept in LRU order
+        self._cache=OrderedDict()
+        self._lock=threading.Lock()
+        self.skipped=0
+        self.cache_hits=0
+        self.rephrased=0
+
+    @classmethod
+    def from_env(cls, question_chain):
+        '''Function: To create the condenser using the settings from the environment'''
+        return cls(question_chain,
+                   cache_size=int(os.environ.get("CONDENSE_CACHE_SIZE","1024")),
+                   short_question_words=int(os.environ.get("CONDENSE_SHORT_QUESTION_WORDS","3")))
+
+    def needs_rephrase(self, question, chat_history):
+        '''Function: To check locally whether the question may reference earlier turns'''
+        if not chat_history:
+            return False
+        if len(question.split())<=self.short_question_words:
+            return True
+        return REFERENCE_PATTERN.search(question) is not None
+
+    def condense(self, question, chat_history, config=None):
+        '''Function: To return the standalone question, from the fast path, the cache or the LLM'''
+        if not self.needs_rephrase(question,chat_history):
+            self.skipped+=1
+            metrics.increment("rephrase_skipped")
+            return question
+        key=(history_digest(chat_history),question)
+        with self._lock:
+            standalone=self._cache.get(key)
+            if standalone is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits+=1
+                metrics.increment("rephrase_cache_hits")
+                return standalone
+        with metrics.span("rephrase"):
+            standalone=self.question_chain.invoke({"input": question,"chat_history": chat_history},config=config)
+        with self._lock:
+            self.rephrased+=1
+            self._cache[key]=standalone
+            while len(self._cache)>self.cache_size:
+                self._cache.popitem(last=False)
+        logger.info(f"Rephrased question into standalone question: {standalone}")
+        return standalone
+
+    def stats(self):
+        '''Function: To report how many questions skipped the rephrase, hit the cache or called the LLM'''
+        return {"skipped": self.skipped, "cache_hits": self.cache_hits, "rephrased": self.rephrased}
@@ -0,0 +1,83 @@
+import time
+import logging
+from typing import List
+
+from chatstore.token_ledger import TokenLedger
+from instrumentation.telemetry import metrics
+
+logger=logging.getLogger(__name__)
+
+
+def truncate(history: List,ledger: TokenLedger,history_budget: int):
+    '''Function to remove the initial conversations from history until it fits in the history budget'''
+    while ledger.total > history_budget and history:
+        ledger.drop_oldest(2)
+        del history[:2]
+    return history
+
+
+class RagPipeline():
+    '''Class to generate the streaming response: standalone question -> answer cache -> hybrid retrieval -> context packing -> LLM'''
+    def __init__(self, resources):
+        '''Constructor for initialization'''
+        self.resources=resources
+
+    def standalone_question(self, request, chat_history, config):
+        '''Function: To rephrase the question into a standalone question using the chat history, only when needed'''
+        return self.resources.query_condenser.condense(request,chat_history,config)
+
+    def stream(self, request, history, ledger):
+        '''Function: To stream the response to the request and record the turn in the chat history'''
+        resources=self.resources
+        turn_start=time.perf_counter()
+        # token length of the chat_history + padding for conversation narative is kept in the ledger,
+        # only messages added since the last turn are encoded
+        ledger.sync(history.messages)
+        tokenlen_input_question=ledger.count(request)
+        #Split MAX_TOKENS between history, retrieved context and response (prompt template sizes are precomputed)
+        budget=resources.budget_allocator.allocate(ledger.total,tokenlen_input_question)
+        #remove the initial conversation in order to avoid context token limit issue
+        truncate(history.messages,ledger,budget.history)
+        #max_output_tokens is passed per request through the run config so the shared llm is never mutated
+        config={"configurable":{"max_output_tokens": budget.output}}
+        chat_history=list(history.messages)
+
+        standalone=self.standalone_question(request,chat_history,config)
+        version=resources.index_version()
+        response=""
+        cached_answer=resources.answer_cache.lookup(standalone,version)
+        if cached_answer is not None:
+            logger.info("Answer served from the semantic answer cache")
+            metrics.increment("answer_cache_hits")
+            answer_chunks=resources.answer_cache.replay(cached_answer)
+        else:
+            with metrics.span("retrieve"):
+                retrieved,timings=resources.retriever.retrieve_with_timings(standalone)
+            for name in ("vector","keyword"):
+                if timings[name] is not None:
+                    metrics.observe(f"retrieve_{name}",timings[name])
+            if timings["fallback"]:
+                metrics.increment("retrieve_fallbacks")
+            logger.info(f"Retrieved {len(retrieved)} chunks, latency per retriever: {timings}")
+            #near-duplicates are dropped and the rest is packed into the context budget by relevance
+            packed=resources.context_packer.pack(retrieved,budget.context)
+            logger.info(f"Packed {len(packed.documents)} chunks in {packed.tokens_used} tokens, saved {packed.tokens_saved} tokens "
+                        f"({packed.duplicates_removed} near-duplicates, {packed.dropped} over budget)")
+            metrics.increment("context_tokens_saved",packed.tokens_saved)
+            answer_chunks=resources.answer_chain.stream({"input": request,"chat_history": chat_history,"context": packed.documents},config=config)
+        generate_start=time.perf_counter()
+        for index,answer_chunk in enumerate(answer_chunks):
+            if index==0:
+                #time to first token is measured from the start of the turn
+                metrics.observe("first_token",time.perf_counter()-turn_start)
+            response+=answer_chunk
+            yield answer_chunk
+        metrics.observe("generate",time.perf_counter()-generate_start)
+        if cached_answer is None:
+            resources.answer_cache.store(standalone,response,version)
+
+        history.add_user_message(request)
+        history.add_ai_message(response)
+        #question is already counted, only the response is encoded
+        ledger.add(tokenlen_input_question)
+        ledger.sync(history.messages)
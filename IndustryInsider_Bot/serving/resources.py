@@ -0,0 +1,206 @@
+import os
+import time
+import logging
+import threading
+
+import tiktoken
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
+from langchain_community.vectorstores import Chroma
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+from promptstore import prompt_store
+from caching.embedding_cache import CachedEmbeddings
+from retrieval.keyword_index import KeywordIndex, PersistentBM25Retriever
+from retrieval.hybrid import HybridRetriever
+from retrieval.vector_index import MmapVectorIndex, VectorIndexRetriever, export_from_env, vector_index_path
+from retrieval.context_packer import ContextPacker
+from chatstore.token_ledger import BudgetAllocator, TokenLedger
+from chatstore.session_store import SessionStore
+from caching.answer_cache import SemanticAnswerCache
+from ingestion.manifest import IngestionManifest
+from serving.rag_pipeline import RagPipeline
+from serving.query_condenser import QueryCondenser
+
+logger=logging.getLogger(__name__)
+
+
+def budgeted_llm(llm):
+    '''Function: To wrap the shared llm so max_output_tokens is read per request from the run config'''
+    def _bind_budget(_input, config):
+        max_output_tokens=config.get("configurable",{}).get("max_output_tokens")
+        if max_output_tokens:
+            #binding creates a lightweight per-request view, the shared llm is never mutated
+            return llm.bind(generation_config={"max_output_tokens": max_output_tokens})
+        return llm
+    return RunnableLambda(_bind_budget)
+
+
+class AppResources():
+    '''Class to build the heavy app objects once, lazily, and share them across reruns and sessions'''
+    def __init__(self):
+        '''Constructor for initialization'''
+        self._lock=threading.RLock()
+        self._resources={}
+        #resource name -> seconds spent building it (cold start)
+        self.build_timings={}
+        self.warm_hits=0
+        self._version_stamp=(None,None)
+
+    def _get(self, name):
+        '''Function: To return a resource, building it on first use'''
+        resource=self._resources.get(name)
+        if resource is not None:
+            self.warm_hits+=1
+            return resource
+        with self._lock:
+            if name not in self._resources:
+                start=time.perf_counter()
+                self._resources[name]=getattr(self,f"_build_{name}")()
+                self.build_timings[name]=time.perf_counter()-start
+                logger.info(f"Built resource '{name}' in {self.build_timings[name]:.3f}s")
+            return self._resources[name]
+
+    def _build_embeddings(self):
+        '''Function: To create the embedding model wrapped with the persistent embedding cache'''
+        return CachedEmbeddings.from_env(HuggingFaceInferenceAPIEmbeddings(
+            api_key=os.environ["HUGGINGFACEHUB_API_TOKEN"],
+            model_name=os.environ["EMBEDDING_MODEL"]
+        ))
+
+    def _build_vector_db(self):
+        '''Function: To load text embeddings from vectorDB'''
+        return Chroma(persist_directory=os.environ["VECTOR_PATH"],embedding_function=self.embeddings)
+
+    def _build_vector_retriever(self):
+        '''Function: To create a retriever to retrieve data from vectorDB, or from the memory-mapped index when VECTOR_STORE=mmap'''
+        if os.environ.get("VECTOR_STORE","chroma")=="mmap":
+            index=MmapVectorIndex.open(vector_index_path())
+            #exported once per ingestion, every other start only maps the files
+            if index is None or index.source_version!=self.index_version():
+                export_from_env(self.index_version()).close()
+            if index is not None:
+                index.close()
+            return VectorIndexRetriever.from_env(self.embeddings)
+        return self.vector_db.as_retriever()
+
+    def _build_keyword_retriever(self):
+        '''Function: To load the retriever for full text search from the persisted BM25 index'''
+        keyword_index=KeywordIndex.from_env()
+        if keyword_index.count()==0:
+            keyword_index.rebuild_from_vectordb(self.vector_db)
+        return PersistentBM25Retriever(index=keyword_index, k=5)
+
+    def _build_retriever(self):
+        '''Function: Hybrid search running vector and keyword retriever concurrently and fusing the ranked chunks'''
+        return HybridRetriever.from_env(self.vector_retriever,self.keyword_retriever)
+
+    def _build_context_packer(self):
+        '''Function: To create the stage fitting the retrieved chunks into the context token budget'''
+        return ContextPacker.from_env(self.encoding,self.embeddings)
+
+    def _build_llm(self):
+        '''Function: To initialize the LLM'''
+        return ChatGoogleGenerativeAI(model=os.environ["GEMINI_MODEL"],google_api_key=os.environ["GEMINI_API_KEY"],temperature=0)
+
+    def _build_encoding(self):
+        '''Function: To initialize the tiktoken encoder to count the token length'''
+        return tiktoken.get_encoding(os.environ["TIKTOKEN_MODEL"])
+
+    def _build_question_maker_prompt(self):
+        '''Function: To load the prompt rephrasing the original question into a standalone question'''
+        return prompt_store.prompt_store.question_maker_prompt()
+
+    def _build_prompt(self):
+        '''Function: To load the prompt generating the response from the retrieved context'''
+        return prompt_store.prompt_store.prompt()
+
+    def _build_prompt_token_counts(self):
+        '''Function: To count the tokens of the prompt templates once, they never change'''
+        return {
+            "question_maker_prompt": len(self.encoding.encode(self.question_maker_prompt.pretty_repr())),
+            "prompt": len(self.encoding.encode(self.prompt.pretty_repr())),
+        }
+
+    def _build_budget_allocator(self):
+        '''Function: To create the allocator dividing MAX_TOKENS between history, context and output'''
+        return BudgetAllocator.from_env(sum(self.prompt_token_counts.values()))
+
+    def _build_session_store(self):
+        '''Function: To open the per-user chat session store'''
+        padding=int(os.environ["TOKEN_HISTORY_PADDING"])
+        return SessionStore.from_env(lambda: TokenLedger(self.encoding,padding))
+
+    def _build_question_chain(self):
+        '''Function: Chain to create standalone question from original question and chat history'''
+        return self.question_maker_prompt | budgeted_llm(self.llm) | StrOutputParser()
+
+    def _build_query_condenser(self):
+        '''Function: To create the stage skipping or caching the standalone question rephrase'''
+        return QueryCondenser.from_env(self.question_chain)
+
+    def _build_answer_chain(self):
+        '''Function: Chain to generate the response using the retrieved context and chat_history'''
+        return create_stuff_documents_chain(budgeted_llm(self.llm), self.prompt)
+
+    def _build_answer_cache(self):
+        '''Function: To create the semantic answer cache'''
+        return SemanticAnswerCache.from_env(self.embeddings)
+
+    def _build_rag_pipeline(self):
+        '''Function: To create the pipeline generating the streaming response'''
+        return RagPipeline(self)
+
+    def index_version(self):
+        '''Function: To return the version stamp of the vector store, re-read only when ingestion rewrote it'''
+        manifest_path=IngestionManifest.default_path()
+        #commits land in the write-ahead log first, the main file changes when it is checkpointed
+        mtime=tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in IngestionManifest.stamp_paths(manifest_path))
+        if mtime!=self._version_stamp[0]:
+            self._version_stamp=(mtime,IngestionManifest.read_version(manifest_path))
+        return self._version_stamp[1]
+
+    embeddings=property(lambda self: self._get("embeddings"))
+    vector_db=property(lambda self: self._get("vector_db"))
+    vector_retriever=property(lambda self: self._get("vector_retriever"))
+    keyword_retriever=property(lambda self: self._get("keyword_retriever"))
+    retriever=property(lambda self: self._get("retriever"))
+    context_packer=property(lambda self: self._get("context_packer"))
+    llm=property(lambda self: self._get("llm"))
+    encoding=property(lambda self: self._get("encoding"))
+    question_maker_prompt=property(lambda self: self._get("question_maker_prompt"))
+    prompt=property(lambda self: self._get("prompt"))
+    prompt_token_counts=property(lambda self: self._get("prompt_token_counts"))
+    budget_allocator=property(lambda self: self._get("budget_allocator"))
+    session_store=property(lambda self: self._get("session_store"))
+    question_chain=property(lambda self: self._get("question_chain"))
+    query_condenser=property(lambda self: self._get("query_condenser"))
+    answer_chain=property(lambda self: self._get("answer_chain"))
+    answer_cache=property(lambda self: self._get("answer_cache"))
+    rag_pipeline=property(lambda self: self._get("rag_pipeline"))
+
+    def warm_up(self):
+        '''Function: To build every resource up front and report whether this was a cold or a warm start'''
+        start=time.perf_counter()
+        cold=not self._resources
+        for name in ("budget_allocator","session_store","retriever","context_packer","query_condenser","answer_chain","answer_cache","rag_pipeline"):
+            self._get(name)
+        elapsed=time.perf_counter()-start
+        logger.info(f"{'Cold' if cold else 'Warm'} start: resources ready in {elapsed:.3f}s")
+        return {"cold": cold, "elapsed_seconds": elapsed, "build_timings": dict(self.build_timings)}
+
+
+_resources=None
+_resources_lock=threading.Lock()
+
+
+def get_resources():
+    '''Function: To return the process-wide resource layer'''
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources=AppResources()
+    return _resources
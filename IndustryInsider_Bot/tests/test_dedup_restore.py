@@ -0,0 +1,80 @@
+'''Deleting an article restores the chunks of other articles which were dropped as near-duplicates of it'''
+import os
+import sys
+import random
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import tiktoken
+
+import data_loading
+from benchmarks.stand_ins import LocalEmbeddings
+from instrumentation.telemetry import teardown
+
+WORDS=("market order company plant steel power project state capacity growth supply contract metro rail bank credit fund "
+       "export import energy solar wind coal truck engine factory investment minister policy tender revenue profit share").split()
+
+
+def sentences(seed, count):
+    '''Function: To generate distinct sentences of 25 common words, each one a token per word'''
+    rng=random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(25)).capitalize()+"." for _ in range(count)]
+
+
+@pytest.fixture
+def loader_factory(tmp_path, monkeypatch):
+    '''Fixture: To point every store into tmp_path and create a fresh Data_loading per ingestion run'''
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        #the encoding is downloaded on first use
+        pytest.skip(f"the cl100k_base encoding is not available: {e!r}")
+    monkeypatch.setattr(data_loading,"HuggingFaceInferenceAPIEmbeddings",LocalEmbeddings)
+    settings={"TIKTOKEN_MODEL": "cl100k_base","MAX_CHUNK_TOKENS": "40","FILE_EXTENSION": ".md",
+              "HUGGINGFACEHUB_API_TOKEN": "offline","EMBEDDING_MODEL": "local-stand-in","VECTOR_STORE": "chroma",
+              "Data_dir": str(tmp_path/"articles"),"VECTOR_PATH": str(tmp_path/"vectordb"),"LOG_DIR": str(tmp_path/"logs"),
+              "LOG_FILE_SIZE": str(1024*1024),"EMBEDDING_CACHE_PATH": str(tmp_path/"embeddings.sqlite3"),
+              "KEYWORD_INDEX_PATH": str(tmp_path/"keyword_index"),"DEDUP_INDEX_PATH": str(tmp_path/"dedup.sqlite3"),
+              "METRICS_EXPORT_PATH": str(tmp_path/"metrics.json")}
+    for key,value in settings.items():
+        monkeypatch.setenv(key,value)
+    for key in ("INGESTION_MANIFEST","METRICS_EXPORT_URL"):
+        monkeypatch.delenv(key,raising=False)
+    (tmp_path/"articles").mkdir()
+    yield data_loading.Data_loading
+    #Data_loading sets up the process-wide log listener and metrics export, both are undone before tmp_path goes away
+    teardown()
+
+
+def stored_texts(loader):
+    '''Function: To read the chunk texts of the vector db and of the keyword index'''
+    keyword=loader.keyword_index._conn.execute("SELECT content FROM documents").fetchall()
+    return set(loader.vector_db.get(include=["documents"])["documents"]),{row[0] for row in keyword}
+
+
+def test_deleted_original_restores_duplicate_chunks(loader_factory):
+    articles=os.environ["Data_dir"]
+    shared,own_a,own_b=sentences(1,8),sentences(2,8),sentences(3,8)
+    with open(os.path.join(articles,"a.md"),'w',encoding="utf-8") as file:
+        file.write(" ".join(own_a+shared))
+    loader_factory().incremental_ingest()
+
+    with open(os.path.join(articles,"b.md"),'w',encoding="utf-8") as file:
+        file.write(" ".join(shared+own_b))
+    loader=loader_factory()
+    loader.incremental_ingest()
+    chunks_b=[chunk.page_content for chunk in loader.chunk_article("b.md",loader.read_article("b.md"))[0]]
+    dropped=len(chunks_b)-len(loader.manifest.chunk_ids_for("b.md"))
+    assert dropped>0, "the shared sentences of b.md were expected to be dropped as duplicates of a.md"
+    assert loader.manifest.dependents(["a.md"])==["b.md"]
+
+    os.remove(os.path.join(articles,"a.md"))
+    loader=loader_factory()
+    loader.incremental_ingest()
+    vector_texts,keyword_texts=stored_texts(loader)
+    assert set(chunks_b)<=vector_texts
+    assert set(chunks_b)<=keyword_texts
+    assert len(loader.manifest.chunk_ids_for("b.md"))==len(chunks_b)
+    assert loader.manifest.dependents(["a.md"])==[]
+    assert loader.vector_db._collection.count()==loader.keyword_index.count()==len(chunks_b)